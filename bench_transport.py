@@ -0,0 +1,102 @@
+"""Compare the latency of tool requests over TCP loopback and over a Unix socket.
+
+Starts search_tool once per transport and sends the same requests to both through an http_client session:
+
+    python bench_transport.py --requests 2000
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+
+import requests
+
+import http_client
+
+tool_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'search_tool')
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    free = s.getsockname()[1]
+    s.close()
+    return free
+
+
+def start_tool(host, port):
+    return subprocess.Popen(
+        ['python', 'main.py', str(port)],
+        cwd=tool_dir,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=dict(os.environ, TOOL_HOST=host),
+    )
+
+
+def wait_until_ready(session, url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if session.get(f'{url}/openapi.json', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def measure(session, url, count):
+    """Send count search requests one after the other, returning the latency of each in milliseconds."""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        session.post(f'{url}/search', json={'query': 'tool'}).raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    return {
+        'mean_ms': round(statistics.mean(ordered), 3),
+        'p50_ms': round(ordered[len(ordered) // 2], 3),
+        'p99_ms': round(ordered[min(len(ordered) - 1, len(ordered) * 99 // 100)], 3),
+        'requests_per_second': round(len(ordered) / (sum(ordered) / 1000), 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='bench_transport')
+    parser.add_argument('-n', '--requests', default=1000, type=int)
+    parser.add_argument('-w', '--warmup', default=50, type=int)
+    args = parser.parse_args()
+    runtime_dir = tempfile.mkdtemp(prefix='bench-transport-')
+    socket_path = os.path.join(runtime_dir, 'search_tool.sock')
+    tcp_port = free_port()
+    transports = {
+        'tcp': ('127.0.0.1', tcp_port, f'http://127.0.0.1:{tcp_port}'),
+        'unix': (f'unix://{socket_path}', 0, http_client.unix_url(socket_path)),
+    }
+    session = http_client.new_session()
+    processes = []
+    results = {}
+    try:
+        for name, (host, port, url) in transports.items():
+            processes.append(start_tool(host, port))
+            wait_until_ready(session, url)
+            measure(session, url, args.warmup)
+            results[name] = summarize(measure(session, url, args.requests))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        os.rmdir(runtime_dir)
+    print(json.dumps(results, indent=2))
@@ -1,4 +1,5 @@
 import argparse
+import itertools
 import json
 import logging
 import os
@@ -9,9 +10,7 @@ import time
 from pathlib import Path
 from typing import Optional
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import http_client
 
 # Setup logging
 Path("logs").mkdir(exist_ok=True)
@@ -20,26 +19,50 @@ logger = logging.getLogger(__name__)
 
 registry_process: Optional[subprocess.Popen[bytes]] = None
 
+# The registry may still be starting, so connections are retried for a while.
+session = http_client.new_session(retries=10, backoff_factor=1)
 
-def interactive(port: int):
+# Tools started as a single batch before the first prompt; chat starts afterwards so it receives their servers.
+boot_tools = ['search_tool', 'create_tool', 'inspect_tool', 'edit_tool']
+
+# Rotates between the replicas of a tool
+server_turns = itertools.count()
+
+
+def interactive(port: int, boot: list[str], gateway: bool = False):
     url = f'http://localhost:{port}'
-    retry_strategy = Retry(connect=10, backoff_factor=1)
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session = requests.Session()
-    session.mount("http://", adapter)
+    chat_session_id = None
+    if boot:
+        start = time.monotonic()
+        try:
+            boot_response = session.post(f'{url}/start', json={"names": boot})
+            boot_response.raise_for_status()
+        except Exception:
+            logger.exception("Failed to boot tools")
+            shutdown()
+        logger.info(f"Booted {', '.join(boot)} in {time.monotonic() - start:.3f}s")
     while True:
         try:
-            user_input = read_user_input()
+            user_input = read_user_input(chat_session_id)
             tool_name = user_input["tool"]
-            start_response = session.post(f'{url}/start', json={"name": tool_name})
-            start_response.raise_for_status()
-            tool_schema = start_response.json()
-            tool_url = tool_schema["servers"][0]["url"]
-            tool_resource = user_input["resource"]
-            tool_response = session.post(f'{tool_url}/{tool_resource}', json=user_input['input'])
+            if gateway:
+                # The gateway starts the tool on its first request, so there is no URL to look up.
+                tool_url = f'{url}/tools/{tool_name}'
+            else:
+                start_response = session.post(f'{url}/start', json={"name": tool_name})
+                start_response.raise_for_status()
+                tool_url = pick_server(start_response.json()["servers"])
+            tool_resource = user_input["resource"].lstrip("/")
+            sent_at = time.monotonic()
+            tool_response = session.post(f'{tool_url}/{tool_resource}', json=user_input['input'], stream=True)
             tool_response.raise_for_status()
-            response = tool_response.json()
-            print(response['content'])
+            if tool_response.headers.get('Content-Type', '').startswith('application/x-ndjson'):
+                response = print_stream(tool_response, sent_at)
+            else:
+                response = tool_response.json()
+                print(response['content'])
+            if tool_name == "chat":
+                chat_session_id = response.get('session_id', chat_session_id)
         except KeyboardInterrupt:
             logger.warning("Keyboard Interrupt")
             shutdown()
@@ -49,23 +72,60 @@ def interactive(port: int):
             return
 
 
-def read_user_input():
+def pick_server(servers: list[dict]) -> str:
+    """Take turns between the replicas of a tool."""
+    urls = [server["url"] for server in servers]
+    return urls[next(server_turns) % len(urls)]
+
+
+def print_stream(response, sent_at: float):
+    """Print NDJSON content chunks as they arrive, returning the final chunk."""
+    first_token_at = None
+    chunk = {}
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if 'error' in chunk:
+            print(chunk['error'])
+        elif chunk.get('done'):
+            print()
+        else:
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+                logger.info(f"Time to first token: {first_token_at - sent_at:.3f}s")
+            print(chunk['content'], end='', flush=True)
+    logger.info(f"Streamed response in {time.monotonic() - sent_at:.3f}s")
+    return chunk
+
+
+def read_user_input(chat_session_id: Optional[str] = None):
     content = input("input: ")
     try:
         user_input = json.loads(content)
     except json.JSONDecodeError:
-        user_input = {"tool": "chat", "resource": "/chat", "input": {"message": content}}
+        user_input = {"tool": "chat", "resource": "/chat", "input": {"message": content, "stream": True}}
+        if chat_session_id:
+            user_input["input"]["session_id"] = chat_session_id
     return user_input
 
 
-def subprocess_server(port: int):
+def subprocess_server(port: int, zygote: bool = False, gateway: bool = False, keep_tools: bool = False):
     logger.info(f"Starting server process on port {port}")
+    env = dict(os.environ)
+    if zygote:
+        env['REGISTRY_ZYGOTE'] = '1'
+    if gateway:
+        env['REGISTRY_GATEWAY'] = '1'
+    if keep_tools:
+        env['REGISTRY_KEEP_TOOLS'] = '1'
     with open(f"logs/bot-server.log", "w") as log_file:
         process = subprocess.Popen(
             ['python', 'main.py', str(port)],
             cwd='tools/registry_tool',
             stdout=log_file,
             stderr=subprocess.STDOUT,
+            env=env,
             start_new_session=True  # Detach process from the parent
         )
     time.sleep(1)
@@ -75,6 +135,7 @@ def subprocess_server(port: int):
 
 def shutdown():
     """Endpoint to shut down the bot and terminate all tools started."""
+    logger.info(f"HTTP connections: {json.dumps(http_client.stats(session))}")
     if registry_process:
         os.kill(registry_process.pid, signal.SIGTERM)
         registry_process.wait()
@@ -86,11 +147,16 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog='bot')
     parser.add_argument("-s", "--server", action="store_true")
     parser.add_argument('-p', '--port', default=8080, type=int)
+    parser.add_argument('-z', '--zygote', action="store_true", help="Fork tools from a pre-warmed process.")
+    parser.add_argument('-g', '--gateway', action="store_true", help="Reach tools through the registry's port.")
+    parser.add_argument('-k', '--keep-tools', action="store_true",
+                        help="Leave tools running on exit, for the next run to reattach to them.")
+    parser.add_argument('-b', '--boot', nargs='*', default=boot_tools, help="Tools to start before the first prompt.")
     args = parser.parse_args(sys.argv[1:])
     signal.signal(signal.SIGTERM, lambda signum, frame: shutdown())
     signal.signal(signal.SIGINT, lambda signum, frame: shutdown())
-    registry_process = subprocess_server(args.port)
+    registry_process = subprocess_server(args.port, zygote=args.zygote, gateway=args.gateway, keep_tools=args.keep_tools)
     if args.server:
         registry_process.wait()
     else:
-        interactive(port=args.port)
+        interactive(port=args.port, boot=args.boot, gateway=args.gateway)
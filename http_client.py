@@ -0,0 +1,140 @@
+"""Shared HTTP client of the bot and its tools.
+
+Sessions keep a pool of keep-alive connections per host, apply a default timeout and retry failed connections.
+Tools import this module after adding the repository root to their path:
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+    import http_client
+
+Besides http:// and https://, sessions dial tools listening on a Unix socket, with the socket's percent-encoded path as
+the host: http+unix://%2Ftmp%2Fbot%2Fsearch_tool.sock/search
+"""
+import os
+import socket
+from urllib.parse import quote, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.poolmanager import SSL_KEYWORDS
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds; the read timeout bounds the wait between two bytes, not the whole response.
+timeout = (float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5)), float(os.environ.get('HTTP_READ_TIMEOUT', 600)))
+# Number of hosts with a pool, and connections kept per host.
+pool_connections = int(os.environ.get('HTTP_POOL_CONNECTIONS', 32))
+pool_maxsize = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))
+connect_retries = int(os.environ.get('HTTP_CONNECT_RETRIES', 3))
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to requests that don't set one."""
+
+    def __init__(self, default_timeout, **kwargs):
+        self.default_timeout = default_timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.default_timeout
+        return super().send(request, **kwargs)
+
+
+def unix_url(socket_path):
+    return f"http+unix://{quote(os.path.abspath(socket_path), safe='')}"
+
+
+class UnixConnection(HTTPConnection):
+    """HTTP connection over a Unix socket; the host is only used in the Host header."""
+
+    def __init__(self, socket_path, *args, **kwargs):
+        self.socket_path = socket_path
+        super().__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixConnectionPool(HTTPConnectionPool):
+    scheme = 'http+unix'
+
+    def __init__(self, host, port=None, **kwargs):
+        # The pool manager only drops the TLS settings for the http scheme
+        for keyword in SSL_KEYWORDS:
+            kwargs.pop(keyword, None)
+        super().__init__('localhost', port, **kwargs)
+        self.socket_path = unquote(host)
+
+    def _new_conn(self):
+        self.num_connections += 1
+        return UnixConnection(self.socket_path, host='localhost', timeout=self.timeout.connect_timeout, **self.conn_kw)
+
+
+class UnixAdapter(PooledAdapter):
+    """PooledAdapter for http+unix:// URLs, keeping a pool of connections per socket."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(self.poolmanager.pool_classes_by_scheme, **{'http+unix': UnixConnectionPool})
+        self.poolmanager.key_fn_by_scheme = dict(self.poolmanager.key_fn_by_scheme, **{'http+unix': self.poolmanager.key_fn_by_scheme['http']})
+
+
+def new_session(retries=None, backoff_factor=0.1, default_timeout=None):
+    """Create a session with pooled connections; only connection errors are retried, since the request wasn't sent."""
+    retry_strategy = Retry(
+        total=None,
+        connect=connect_retries if retries is None else retries,
+        read=0,
+        redirect=3,
+        status=0,
+        other=0,
+        backoff_factor=backoff_factor,
+    )
+    adapter = PooledAdapter(
+        timeout if default_timeout is None else default_timeout,
+        max_retries=retry_strategy,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+    )
+    new = requests.Session()
+    new.mount("http://", adapter)
+    new.mount("https://", adapter)
+    new.mount("http+unix://", UnixAdapter(
+        timeout if default_timeout is None else default_timeout,
+        max_retries=retry_strategy,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+    ))
+    return new
+
+
+def stats(stats_session=None):
+    """Connections opened and requests sent per host; reuse_rate is the share of requests sent on a kept-alive connection."""
+    stats_session = stats_session or session
+    hosts = {}
+    adapters = {id(adapter): adapter for adapter in stats_session.adapters.values()}
+    for adapter in adapters.values():
+        if not isinstance(adapter, HTTPAdapter):
+            continue
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            name = unix_url(pool.socket_path) if isinstance(pool, UnixConnectionPool) else f"{pool.scheme}://{pool.host}:{pool.port}"
+            host = hosts.setdefault(name, {'connections': 0, 'requests': 0})
+            host['connections'] += pool.num_connections
+            host['requests'] += pool.num_requests
+    for host in hosts.values():
+        host['reuse_rate'] = round(1 - host['connections'] / host['requests'], 3) if host['requests'] else None
+    return hosts
+
+
+# Session shared by everything in the process
+session = new_session()
@@ -0,0 +1,158 @@
+"""In-memory full-text index with BM25 ranking.
+
+Documents can be added, replaced and removed one at a time, so an index is updated incrementally as tools change.
+Fuzzy searches also match the indexed terms that share enough trigrams with a query term, which catches typos and
+partial words: "serch" and "sear" both match "search".
+"""
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# Splits snake_case, camelCase and prose into words
+token_pattern = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+
+
+def tokenize(text):
+    return [normalize(token) for token in token_pattern.findall(text or '')]
+
+
+def trigrams(term):
+    """Trigrams of a term padded with '$', so that its first and last letters count: "tool" -> $to, too, ool, ol$."""
+    padded = f'${term}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def rank(scores, limit=None, offset=0):
+    """Return the (doc_id, score) pairs of a page, best first; with a limit, only the page is sorted."""
+    items = scores.items()
+    if limit is not None and offset + limit < len(scores):
+        if offset + limit == 0:
+            return []
+        # The lowest score of the page, found on the bare floats; the documents tied with it are kept for the tie-break.
+        lowest = heapq.nlargest(offset + limit, scores.values())[-1]
+        items = [item for item in items if item[1] >= lowest]
+    ranked = sorted(items, key=lambda item: (-item[1], str(item[0])))
+    return ranked[offset:] if limit is None else ranked[offset:offset + limit]
+
+
+def normalize(token):
+    """Lowercase a token and strip a plural 's', so that "tools" matches "tool"."""
+    token = token.lower()
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+class BM25Index:
+    # Fuzzy matches need this Dice similarity of their trigrams with the query term, and score this much less than exact ones.
+    min_similarity = 0.5
+    fuzzy_weight = 0.5
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {doc_id: term frequency}
+        self.postings = defaultdict(dict)
+        # trigram -> terms of the vocabulary containing it
+        self.trigram_terms = defaultdict(set)
+        self.doc_terms = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        # term -> {doc_id: BM25 score of the term in the document}, computed on first use. Cleared whenever a document
+        # changes, since the idf and the average document length, and so every score, change with it.
+        self.term_scores = {}
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_terms
+
+    def add(self, doc_id, text):
+        self.remove(doc_id)
+        self.term_scores.clear()
+        terms = Counter(tokenize(text))
+        self.doc_terms[doc_id] = terms
+        self.doc_lengths[doc_id] = sum(terms.values())
+        self.total_length += self.doc_lengths[doc_id]
+        for term, frequency in terms.items():
+            if term not in self.postings:
+                for trigram in trigrams(term):
+                    self.trigram_terms[trigram].add(term)
+            self.postings[term][doc_id] = frequency
+
+    def remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self.term_scores.clear()
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in terms:
+            del self.postings[term][doc_id]
+            if not self.postings[term]:
+                del self.postings[term]
+                for trigram in trigrams(term):
+                    self.trigram_terms[trigram].discard(term)
+                    if not self.trigram_terms[trigram]:
+                        del self.trigram_terms[trigram]
+
+    def idf(self, term):
+        document_frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.doc_terms) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def scores_of(self, term):
+        """Return the BM25 score of the term in each document containing it."""
+        term_scores = self.term_scores.get(term)
+        if term_scores is None:
+            postings = self.postings.get(term)
+            if not postings:
+                return {}
+            k1, b = self.k1, self.b
+            idf = self.idf(term)
+            average_length = self.total_length / len(self.doc_terms)
+            term_scores = self.term_scores[term] = {
+                doc_id: idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * self.doc_lengths[doc_id] / average_length))
+                for doc_id, frequency in postings.items()
+            }
+        return term_scores
+
+    def score_terms(self, terms, scores=None, weight=1.0):
+        """Add the BM25 score of each document containing the terms to scores."""
+        scores = {} if scores is None else scores
+        for term in terms:
+            term_scores = self.scores_of(term)
+            if not scores and weight == 1.0:
+                scores.update(term_scores)
+                continue
+            for doc_id, score in term_scores.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * score
+        return scores
+
+    def similar_terms(self, term):
+        """Return (term, similarity) pairs of the other indexed terms sharing enough trigrams with the term."""
+        query_trigrams = trigrams(term)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.trigram_terms.get(trigram, ()))
+        similar = []
+        for candidate, count in shared.items():
+            # Dice coefficient; a padded term of n letters has n trigrams
+            similarity = 2 * count / (len(query_trigrams) + len(candidate))
+            if candidate != term and similarity >= self.min_similarity:
+                similar.append((candidate, similarity))
+        return similar
+
+    def match(self, query, fuzzy=False):
+        """Return the score of each document matching the query, unsorted."""
+        terms = set(tokenize(query))
+        scores = self.score_terms(terms)
+        if fuzzy:
+            for term in terms:
+                for similar, similarity in self.similar_terms(term):
+                    self.score_terms([similar], scores, self.fuzzy_weight * similarity)
+        return scores
+
+    def search(self, query, limit=None, offset=0, fuzzy=False):
+        """Return (doc_id, score) pairs of the documents matching the query, best first."""
+        return rank(self.match(query, fuzzy), limit, offset)
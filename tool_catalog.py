@@ -0,0 +1,141 @@
+"""In-memory index of the tool directories and of the metadata found in their main.py.
+
+A tool is a directory of tools/ with a main.py. Its metadata (title, description, operation summaries and ids, paths and
+function names) is read from the source with the ast module, without running it. Refreshing stats each main.py and only
+parses those whose mtime or size changed. There is no inotify in the standard library, so callers refresh by polling:
+`tools()` refreshes at most once per poll_interval, and `refresh()` forces it, e.g. after create_tool or edit_tool wrote a
+tool. After `start_polling()`, a daemon thread refreshes instead, so that callers never scan the directory themselves.
+"""
+import ast
+import hashlib
+import logging
+import os
+import threading
+import time
+
+tools_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools')
+poll_interval = float(os.environ.get('TOOL_CATALOG_POLL_INTERVAL', 1))
+
+
+def read_metadata(source):
+    """Extract the strings of the OpenAPI Object a tool builds in its source."""
+    metadata = {'title': None, 'description': None, 'summaries': [], 'operation_ids': [], 'paths': [], 'functions': []}
+    tree = ast.parse(source)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            metadata['functions'].append(node.name)
+        if not isinstance(node, ast.Dict):
+            continue
+        for key, value in zip(node.keys, node.values):
+            if not isinstance(key, ast.Constant) or not isinstance(key.value, str):
+                continue
+            if key.value == 'info' and isinstance(value, ast.Dict):
+                info = dict(constant_items(value))
+                metadata['title'] = metadata['title'] or info.get('title')
+                metadata['description'] = metadata['description'] or info.get('description')
+            elif key.value == 'paths' and isinstance(value, ast.Dict):
+                metadata['paths'].extend(path for path in constant_keys(value) if path.startswith('/'))
+            elif key.value == 'summary' and is_string(value):
+                metadata['summaries'].append(value.value)
+            elif key.value == 'operationId' and is_string(value):
+                metadata['operation_ids'].append(value.value)
+    return metadata
+
+
+def constant_items(node):
+    return [(key.value, value.value) for key, value in zip(node.keys, node.values) if is_string(key) and is_string(value)]
+
+
+def constant_keys(node):
+    return [key.value for key in node.keys if is_string(key)]
+
+
+def is_string(node):
+    return isinstance(node, ast.Constant) and isinstance(node.value, str)
+
+
+class ToolCatalog:
+    def __init__(self, directory=tools_dir, interval=poll_interval):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.generation = 0
+        self.checked_at = None
+        self.polling = False
+
+    def tools(self):
+        """Return the entry of each tool by name, refreshing first if the last check is older than the interval."""
+        self.refresh_if_due()
+        with self.lock:
+            return dict(self.entries)
+
+    def get(self, tool_name):
+        self.refresh_if_due()
+        with self.lock:
+            return self.entries.get(tool_name)
+
+    def refresh_if_due(self):
+        if self.polling:
+            return
+        with self.lock:
+            due = self.checked_at is None or time.monotonic() - self.checked_at >= self.interval
+        if due:
+            self.refresh()
+
+    def start_polling(self, on_change=None):
+        """Refresh once, then every interval on a daemon thread, calling on_change after a refresh that found changes."""
+        self.refresh()
+        self.polling = True
+
+        def poll():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    if self.refresh() and on_change:
+                        on_change()
+                except Exception:
+                    logging.exception("Failed to refresh the tool catalog")
+
+        threading.Thread(target=poll, name='tool-catalog', daemon=True).start()
+
+    def refresh(self):
+        """Re-read the tools that were added or changed, and forget removed ones; returns the names of all of them."""
+        with self.lock:
+            found = {}
+            for tool_dir in os.scandir(self.directory):
+                if tool_dir.name.startswith(('.', '__')) or not tool_dir.is_dir():
+                    continue
+                try:
+                    found[tool_dir.name] = os.stat(os.path.join(tool_dir.path, 'main.py'))
+                except OSError:
+                    continue
+            changed = {name for name in self.entries if name not in found}
+            for name in changed:
+                del self.entries[name]
+            for name, stat in found.items():
+                entry = self.entries.get(name)
+                if entry is None or (entry['mtime'], entry['size']) != (stat.st_mtime, stat.st_size):
+                    self.entries[name] = self.read_tool(name, stat)
+                    changed.add(name)
+            if changed:
+                self.generation += 1
+            self.checked_at = time.monotonic()
+            return changed
+
+    def read_tool(self, tool_name, stat):
+        path = os.path.join(self.directory, tool_name, 'main.py')
+        with open(path, 'rb') as f:
+            source = f.read()
+        entry = {
+            'name': tool_name,
+            'path': path,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': hashlib.sha256(source).hexdigest(),
+        }
+        try:
+            entry.update(read_metadata(source))
+        except (SyntaxError, ValueError) as e:
+            entry.update(read_metadata(''), error=f"{type(e).__name__}: {e}")
+        return entry
@@ -0,0 +1,63 @@
+"""Keeps the messages sent to Ollama under a token budget by compacting tool outputs.
+
+Tokens are estimated from the number of characters. Only tool outputs are compacted, in this order:
+JSON is minified, long outputs are truncated, then outputs of earlier turns are dropped, oldest first.
+System, user and assistant messages are always sent as they are.
+"""
+import json
+
+chars_per_token = 4
+# Tokens of role and formatting around each message
+message_overhead = 4
+truncation_marker = "\n[... {} characters truncated]"
+dropped_marker = "[Output of an earlier tool call dropped to save context.]"
+
+
+def estimate_tokens(message):
+    chars = len(message.get("content") or "")
+    if message.get("tool_calls"):
+        chars += len(json.dumps(message["tool_calls"]))
+    return chars // chars_per_token + message_overhead
+
+
+def minify(content):
+    try:
+        return json.dumps(json.loads(content), separators=(',', ':'))
+    except ValueError:
+        return content
+
+
+def truncate(content, max_chars):
+    if len(content) <= max_chars:
+        return content
+    return content[:max_chars] + truncation_marker.format(len(content) - max_chars)
+
+
+def fit_messages(messages, budget, max_tool_chars):
+    """Return a compacted copy of the messages, with their estimated tokens before and after compaction."""
+    before = sum(estimate_tokens(message) for message in messages)
+    fitted = [
+        dict(message, content=truncate(minify(message["content"]), max_tool_chars)) if message.get("role") == "tool" else message
+        for message in messages
+    ]
+    total = sum(estimate_tokens(message) for message in fitted)
+    if total > budget:
+        # Tool outputs before the last assistant message are from earlier turns; the model has already read them.
+        last_turn = max((i for i, message in enumerate(fitted) if message.get("role") == "assistant"), default=len(fitted))
+        for i in range(last_turn):
+            if total <= budget:
+                break
+            if fitted[i].get("role") == "tool" and fitted[i]["content"] != dropped_marker:
+                dropped = dict(fitted[i], content=dropped_marker)
+                total += estimate_tokens(dropped) - estimate_tokens(fitted[i])
+                fitted[i] = dropped
+    if total > budget:
+        # Still too long: share what remains of the budget between the outputs of the last turn.
+        latest = [i for i, message in enumerate(fitted) if message.get("role") == "tool" and message["content"] != dropped_marker]
+        if latest:
+            others = total - sum(estimate_tokens(fitted[i]) for i in latest)
+            share = max(((budget - others) // len(latest) - message_overhead) * chars_per_token - len(truncation_marker) - 10, 0)
+            for i in latest:
+                fitted[i] = dict(fitted[i], content=truncate(fitted[i]["content"], share))
+            total = sum(estimate_tokens(message) for message in fitted)
+    return fitted, before, total
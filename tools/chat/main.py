@@ -1,17 +1,49 @@
+import atexit
+import itertools
 import json
 import logging
+import os
+import queue
+import random
 import sys
+import threading
+import time
 import traceback
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from urllib.parse import quote
 
 import requests
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import http_client
+from text_index import BM25Index
+from context_budget import chars_per_token, fit_messages
+from response_cache import ResponseCache, cache_key
 
 OLLAMA_API_URL = "http://localhost:11434/api/chat"
+# How long Ollama keeps the model, and the prompt cache of the last conversation, loaded after a request
+ollama_keep_alive = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
 self_name = 'chat'
 tool_blacklist = [self_name] # Don't allow self-calls, the LLM gets too confused.
 
-logging.basicConfig(filename=f'{self_name}.log', level=logging.INFO)
+# Records are written by a background thread, to a file that rotates at CHAT_LOG_MAX_BYTES.
+# Request and response bodies are only logged at DEBUG, for a sample of the calls, compact and truncated.
+log_payload_chars = int(os.environ.get('CHAT_LOG_PAYLOAD_CHARS', 2000))
+log_sample_rate = float(os.environ.get('CHAT_LOG_SAMPLE_RATE', 1.0))
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, RotatingFileHandler(
+    f'{self_name}.log',
+    maxBytes=int(os.environ.get('CHAT_LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    backupCount=int(os.environ.get('CHAT_LOG_BACKUPS', 3)),
+))
+logging.basicConfig(level=os.environ.get('CHAT_LOG_LEVEL', 'INFO'), handlers=[QueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
 
 app = Flask(self_name)
 
@@ -20,6 +52,63 @@ port = int(sys.argv[1])
 # OpenAPI Object for each tool
 openapi_objects = {}
 
+# operationId -> endpoint of the operation, rebuilt whenever openapi_objects changes
+dispatch_index = {}
+# Tools the registry reported as stopped; their URL may now belong to another process, so they are started before use.
+stopped_tools = set()
+schema_lock = threading.Lock()
+
+# Requests in progress per server URL; each call goes to the replica of the tool with the fewest.
+outstanding = Counter()
+outstanding_lock = threading.Lock()
+# Rotates the first candidate, so that idle replicas take turns.
+server_turns = itertools.count()
+
+# Operations sent to the model for each request, in addition to request_tool and the tools it already called
+max_tools = int(os.environ.get('CHAT_MAX_TOOLS', 8))
+
+# Tool calls of the same model turn run concurrently
+tool_call_timeout = float(os.environ.get('CHAT_TOOL_TIMEOUT', 120))
+tool_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('CHAT_TOOL_WORKERS', 8)), thread_name_prefix='tool')
+
+# Results of idempotent operations (GET, or x-cache-ttl seconds), keyed on the operation and its arguments
+tool_result_ttl = float(os.environ.get('CHAT_TOOL_RESULT_TTL', 60))
+max_tool_results = int(os.environ.get('CHAT_MAX_TOOL_RESULTS', 512))
+tool_results = OrderedDict()
+tool_results_lock = threading.Lock()
+tool_results_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+# Ollama responses to temperature 0 requests, optionally persisted to CHAT_CACHE_DIR
+response_cache = ResponseCache(
+    max_memory_bytes=int(os.environ.get('CHAT_CACHE_MEMORY_BYTES', 32 * 1024 * 1024)),
+    directory=os.environ.get('CHAT_CACHE_DIR'),
+    max_disk_bytes=int(os.environ.get('CHAT_CACHE_DISK_BYTES', 256 * 1024 * 1024)),
+)
+
+# Estimated tokens of messages and tools sent to the model; longer tool outputs are compacted to fit
+context_token_budget = int(os.environ.get('CHAT_CONTEXT_BUDGET', 8000))
+max_tool_output_chars = int(os.environ.get('CHAT_MAX_TOOL_OUTPUT_CHARS', 8000))
+context_stats = {"requests": 0, "compacted": 0, "tokens_saved": 0}
+context_stats_lock = threading.Lock()
+
+# Heartbeats sent to the registry for the tools in use, which it would otherwise evict when idle
+heartbeat_interval = float(os.environ.get('CHAT_HEARTBEAT_INTERVAL', 15))
+last_heartbeats = {}
+heartbeat_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='heartbeat')
+
+# Conversation histories by session id, least recently used first
+sessions = OrderedDict()
+sessions_lock = threading.Lock()
+session_ttl = float(os.environ.get('CHAT_SESSION_TTL', 3600))
+max_sessions = int(os.environ.get('CHAT_MAX_SESSIONS', 64))
+
+system_prompt = """\
+You are a chat bot that responds directly to the human user.
+In some cases, the user may make a request that requires the use of tools.
+You have access to a strict list of tools.
+Tool outputs are not visible to the user, so you should read their output to answer the user's prompt.
+When invoking a tool, you must pick one from the provided list."""
+
 self_schema = {
     "openapi": "3.1.0",
     "info": {
@@ -62,7 +151,130 @@ self_schema = {
     }
 }
 
-openapi_objects["chat"] = self_schema
+
+class ToolCatalog:
+    """Ollama tools converted from openapi_objects, cached until the next generation.
+
+    Tools are indexed by name, description and parameters, so each request can send only the most relevant ones.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.built_generation = -1
+        self.tools = []
+        self.tools_json = []
+        self.index = BM25Index()
+        # Tools added with request_tool are always sent
+        self.requested = set()
+
+    def bump(self):
+        with self.lock:
+            self.generation += 1
+
+    def get(self):
+        """Return the tools and their pre-serialized JSON, converting them only once per generation."""
+        # register_schema changes openapi_objects and bumps the generation under schema_lock, which is taken before
+        # self.lock; converting a snapshot lets concurrent tool calls register schemas meanwhile.
+        with schema_lock:
+            generation = self.generation
+            objects = dict(openapi_objects)
+        with self.lock:
+            # A thread holding an older snapshot must not replace the tools of a newer generation
+            if self.built_generation < generation:
+                self.tools = convert_tools(objects)
+                self.tools_json = [json.dumps(tool) for tool in self.tools]
+                self.index = BM25Index()
+                for tool in self.tools:
+                    self.index.add(tool["function"]["name"], describe_tool(tool))
+                self.built_generation = generation
+                app.logger.info(f"Defined {len(self.tools)} tools for generation {generation}")
+            return self.tools, self.tools_json
+
+    def request(self, tool_name):
+        self.requested.add(tool_name)
+
+    def select(self, query, called=()):
+        """Return the max_tools tools most relevant to the query, with the tools already called and requested."""
+        tools, tools_json = self.get()
+        if len(tools) <= max_tools + 1:
+            return tools, tools_json
+        keep = {name for name, _ in self.index.search(query, max_tools)}
+        keep.update(called)
+        keep.add("request_tool")
+        selected = [
+            i for i, tool in enumerate(tools)
+            if tool["function"]["name"] in keep or dispatch_index.get(tool["function"]["name"], {}).get("tool") in self.requested
+        ]
+        app.logger.info(f"Selected {len(selected)} of {len(tools)} tools")
+        return [tools[i] for i in selected], [tools_json[i] for i in selected]
+
+
+catalog = ToolCatalog()
+
+
+def describe_tool(tool):
+    """Text indexed for a tool: its name, description, parameters, and the OpenAPI Object it belongs to."""
+    function = tool["function"]
+    words = [function["name"], function.get("description", "")]
+    for name, parameter in function["parameters"].get("properties", {}).items():
+        words.extend([name, parameter.get("description", "")])
+    owner = openapi_objects.get(dispatch_index.get(function["name"], {}).get("tool"))
+    if owner:
+        words.extend([owner["info"].get("title", ""), owner["info"].get("description", "")])
+    return " ".join(words)
+
+
+def tool_query(messages):
+    """The last user message, and the tools called since, which the model may call again."""
+    query = ""
+    called = set()
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            query = message.get("content", "")
+            break
+        for tool_call in message.get("tool_calls", []):
+            called.add(tool_call["function"]["name"])
+    return query, called
+
+
+def register_schema(tool_name, schema):
+    """Add or replace a tool's OpenAPI Object; all changes to openapi_objects go through here."""
+    with schema_lock:
+        replaced = tool_name in openapi_objects
+        openapi_objects[tool_name] = schema
+        stopped_tools.discard(tool_name)
+        build_dispatch_index()
+        catalog.bump()
+    if replaced:
+        # The tool was restarted or updated, so its cached results may be stale.
+        invalidate_tool_results(tool=tool_name)
+
+
+def operation_name(method, path, operation):
+    return operation.get("operationId", f"{method}_{path.strip('/').replace('/', '_')}")
+
+
+def build_dispatch_index():
+    """Map each operation name to its base URL, path, method and parameter locations."""
+    global dispatch_index
+    index = {}
+    for tool_name, openapi in openapi_objects.items():
+        tool_urls = [server["url"] for server in openapi["servers"]]
+        for path, operations in openapi.get("paths", {}).items():
+            for method, operation in operations.items():
+                index.setdefault(operation_name(method, path, operation), {
+                    "tool": tool_name,
+                    "urls": tool_urls,
+                    "path": path,
+                    "method": method.lower(),
+                    "parameters": {param["name"]: param.get("in", "query") for param in operation.get("parameters", [])},
+                    "cache_ttl": operation.get("x-cache-ttl", tool_result_ttl if method.lower() == "get" else 0),
+                })
+    dispatch_index = index
+
+
+register_schema("chat", self_schema)
 
 
 @app.route('/openapi.json', methods=['GET'])
@@ -75,65 +287,237 @@ def get_tools_schemas_route():
     return openapi_objects
 
 
+@app.route('/tools/schemas', methods=['POST'])
+def update_tools_schemas_route():
+    """Replace the schemas of tools already in the context, e.g. when the registry restarts them.
+
+    A null schema means that the registry stopped the tool; it stays in the context and is started again when called.
+    """
+    updated = [tool_name for tool_name in request.json if tool_name in openapi_objects]
+    for tool_name in updated:
+        if request.json[tool_name] is None:
+            with schema_lock:
+                stopped_tools.add(tool_name)
+        else:
+            register_schema(tool_name, request.json[tool_name])
+    return jsonify({'updated': updated, 'generation': catalog.generation})
+
+
 def call_tool(tool_call, tool_depth=0):
     """Maps a tool call to an operation on an OpenAPI object."""
     invoked_name = tool_call["function"]["name"]
+    route = dispatch_index.get(invoked_name)
+    if route is None:
+        return {"role": "tool", "content": f"Error! No matching path or method for tool: {invoked_name}"}
+    arguments = tool_call["function"].get("arguments", {})
+    result_key = (invoked_name, json.dumps(arguments, sort_keys=True))
+    if route["cache_ttl"]:
+        cached = cached_tool_result(result_key)
+        if cached is not None:
+            app.logger.info(f"{invoked_name} result from cache")
+            return {"role": "tool", "content": cached}
     try:
-        for tool_name, openapi in openapi_objects.items():
-            tool_schema = openapi_objects[tool_name]
-
-            # Find the correct path and method matching the operationId
-            matching_path = None
-            matching_method = None
-            for path, operations in tool_schema["paths"].items():
-                for method, operation in operations.items():
-                    if operation.get("operationId") == invoked_name:
-                        matching_path = path
-                        matching_method = method
-                        break
-                if matching_path:
-                    break
-
-            if not matching_path or not matching_method:
-                continue  # Try the next tool
-
-            # Construct the endpoint URL
-            tool_url = tool_schema["servers"][0]["url"]  # Assuming the first server URL is valid
-            endpoint = f"{tool_url}{matching_path}"
-
-            # Extract parameters from the tool_call
-            tool_parameters = tool_call["function"].get("arguments", {})
-
-            headers = {"X-Tool-Depth": str(tool_depth + 1)}
-
-            # Issue the appropriate HTTP request (currently supports POST)
-            if matching_method.lower() == "post":
-                app.logger.info(f"POST {endpoint} tool_depth={tool_depth}\n{json.dumps(tool_parameters, indent=4)}")
-                response = requests.post(endpoint, json=tool_parameters, headers=headers)
-            elif matching_method.lower() == "get":
-                app.logger.info(f"GET {endpoint} with params {json.dumps(tool_parameters, indent=4)}")
-                response = requests.get(endpoint, params=tool_parameters, headers=headers)
-            else:
-                return {"role": "tool", "content": f"Unsupported HTTP method: {matching_method}"}
-
-            response.raise_for_status()
-            result = response.json()
-
-            return {"role": "tool", "content": json.dumps(result, indent=4)}
+        # Extract parameters from the tool_call, moving path and query parameters out of the body
+        tool_parameters = dict(arguments)
+        path = route["path"]
+        query = {}
+        for name, location in route["parameters"].items():
+            if name not in tool_parameters:
+                continue
+            if location == "path":
+                path = path.replace(f"{{{name}}}", quote(str(tool_parameters.pop(name)), safe=''))
+            elif location == "query":
+                query[name] = tool_parameters.pop(name)
+
+        # Issue the appropriate HTTP request (currently supports POST and GET)
+        if route["method"] == "get":
+            query.update(tool_parameters)
+            tool_parameters = None
+        elif route["method"] != "post":
+            return {"role": "tool", "content": f"Unsupported HTTP method: {route['method']}"}
+
+        if route["tool"] in stopped_tools and restart_tool(route["tool"]):
+            route = dispatch_index[invoked_name]
+        try:
+            response = send_tool_request(route, path, query, tool_parameters, tool_depth)
+        except requests.ConnectionError:
+            # The registry may have evicted the tool: start it again and retry once.
+            if not restart_tool(route["tool"]):
+                raise
+            route = dispatch_index[invoked_name]
+            response = send_tool_request(route, path, query, tool_parameters, tool_depth)
+        heartbeat(route["tool"])
+        response.raise_for_status()
+        result = response.json()
+
+        content = json.dumps(result, separators=(',', ':'))
+        if route["cache_ttl"]:
+            cache_tool_result(result_key, route, arguments, content)
+        else:
+            # A call that may have side effects: forget what was cached for the tool and for the tools it names.
+            invalidate_tool_results(tool=route["tool"], names=referenced_tools(arguments))
+        return {"role": "tool", "content": content}
     except Exception:
         app.logger.error(f"Error invoking tool:\n{traceback.format_exc()}")
         return {"role": "tool", "content": f"Error invoking tool:\n{traceback.format_exc()}"}
-    return {"role": "tool", "content": f"Error! No matching path or method for tool: {invoked_name}"}
+
+
+def send_tool_request(route, path, query, body, tool_depth):
+    url = pick_server(route["urls"])
+    endpoint = f"{url}{path}"
+    method = route["method"].upper()
+    app.logger.info(f"{method} {endpoint} tool_depth={tool_depth}")
+    log_payload(f"{method} {endpoint}", body if body is not None else query)
+    headers = {"X-Tool-Depth": str(tool_depth + 1)}
+    try:
+        return http_client.session.request(method, endpoint, params=query, json=body, headers=headers)
+    finally:
+        with outstanding_lock:
+            outstanding[url] -= 1
+            if not outstanding[url]:
+                del outstanding[url]
+
+
+def pick_server(urls):
+    """Return the URL with the fewest requests in progress, and count the request about to be sent to it."""
+    with outstanding_lock:
+        turn = next(server_turns) % len(urls)
+        url = min(urls[turn:] + urls[:turn], key=lambda candidate: outstanding[candidate])
+        outstanding[url] += 1
+    return url
+
+
+def registry_url():
+    registry = openapi_objects.get("registry_tool")
+    return registry["servers"][0]["url"] if registry else None
+
+
+def published_schema(tool_name):
+    """The registry's copy of a running tool's schema; None if there is no registry, or it doesn't know the tool."""
+    url = registry_url()
+    if url is None or tool_name in (self_name, "registry_tool"):
+        return None
+    try:
+        response = http_client.session.post(f"{url}/start", json={"name": tool_name})
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError):
+        app.logger.warning(f"The registry has no schema for '{tool_name}'")
+        return None
+
+
+def restart_tool(tool_name):
+    """Ask the registry to start a tool again and register its new schema; False if there is no registry to ask."""
+    url = registry_url()
+    if url is None or tool_name in (self_name, "registry_tool"):
+        return False
+    app.logger.info(f"Asking the registry to start '{tool_name}'")
+    response = http_client.session.post(f"{url}/start", json={"name": tool_name})
+    response.raise_for_status()
+    register_schema(tool_name, response.json())
+    return True
+
+
+def heartbeat(tool_name):
+    """Tell the registry that a tool is in use so it isn't evicted, at most once per interval per tool."""
+    url = registry_url()
+    now = time.monotonic()
+    if url is None or tool_name == "registry_tool" or now - last_heartbeats.get(tool_name, -heartbeat_interval) < heartbeat_interval:
+        return
+    last_heartbeats[tool_name] = now
+    heartbeat_executor.submit(post_heartbeat, url, tool_name)
+
+
+def post_heartbeat(url, tool_name):
+    try:
+        http_client.session.post(f"{url}/heartbeat", json={"name": tool_name}, timeout=5)
+    except requests.RequestException:
+        app.logger.warning(f"Failed to send the heartbeat of '{tool_name}'")
+
+
+def referenced_tools(arguments):
+    return {str(arguments[name]) for name in ("tool_name", "name") if name in arguments}
+
+
+def cached_tool_result(key):
+    with tool_results_lock:
+        entry = tool_results.get(key)
+        if entry is None or entry["expires_at"] < time.monotonic():
+            tool_results_stats["misses"] += 1
+            return None
+        tool_results_stats["hits"] += 1
+        return entry["content"]
+
+
+def cache_tool_result(key, route, arguments, content):
+    now = time.monotonic()
+    with tool_results_lock:
+        tool_results.pop(key, None)
+        tool_results[key] = {
+            "expires_at": now + route["cache_ttl"],
+            "tool": route["tool"],
+            "names": referenced_tools(arguments),
+            "content": content,
+        }
+        while len(tool_results) > max_tool_results:
+            tool_results.popitem(last=False)
+
+
+def invalidate_tool_results(tool=None, names=()):
+    """Drop the cached results of a tool, and of calls about any of the named tools."""
+    names = set(names) | {tool}
+    with tool_results_lock:
+        stale = [key for key, entry in tool_results.items() if entry["tool"] == tool or entry["names"] & names]
+        for key in stale:
+            del tool_results[key]
+        tool_results_stats["invalidations"] += len(stale)
+
+
+def call_tools(tool_calls, tool_depth=0):
+    """Run the tool calls of one model turn concurrently, returning their results in call order."""
+    start = time.monotonic()
+    futures = [tool_executor.submit(timed_call, tool_call, tool_depth) for tool_call in tool_calls]
+    results = []
+    elapsed_total = 0.0
+    for tool_call, future in zip(tool_calls, futures):
+        invoked_name = tool_call["function"]["name"]
+        try:
+            result, elapsed = future.result(timeout=max(0.0, start + tool_call_timeout - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            app.logger.error(f"{invoked_name} timed out after {tool_call_timeout}s")
+            result, elapsed = {"role": "tool", "content": f"Error invoking tool: timed out after {tool_call_timeout}s"}, tool_call_timeout
+        elapsed_total += elapsed
+        results.append(result)
+    wall = time.monotonic() - start
+    if len(tool_calls) > 1:
+        app.logger.info(f"Ran {len(tool_calls)} tool calls in {wall:.3f}s, {elapsed_total:.3f}s sequentially ({elapsed_total / max(wall, 1e-6):.1f}x)")
+    return results
+
+
+def timed_call(tool_call, tool_depth):
+    start = time.monotonic()
+    invoked_name = tool_call["function"]["name"]
+    # LLMs like to respond with a tool, so we give it one.
+    if invoked_name == "request_tool":
+        result = request_tool(tool_call)
+    else:
+        result = call_tool(tool_call, tool_depth)
+    elapsed = time.monotonic() - start
+    app.logger.info(f"{invoked_name} took {elapsed:.3f}s")
+    return result, elapsed
 
 
 def request_tool(tool_call):
     """A virtual tool that adds a tool to the LLM context."""
     tool_url = tool_call["function"]["arguments"]["url"]
     schema = get_schema(tool_url)
-    tool_name = openapi_objects[schema["title"]]
-    openapi_objects[tool_name] = schema
+    tool_name = schema["info"]["title"]
+    # A tool only knows the port it was given; the registry's copy has the URLs it is reached at, e.g. its Unix socket.
+    register_schema(tool_name, published_schema(tool_name) or schema)
+    catalog.request(tool_name)
     app.logger.info(f"Received {tool_name}")
-    return {"role": "tool", "content": "Tool {tool_name} has been added to the context."}
+    return {"role": "tool", "content": f"Tool {tool_name} has been added to the context."}
 
 
 @app.route('/chat', methods=['POST'])
@@ -144,49 +528,121 @@ def chat_route():
         return jsonify({'content': "You have reached the maximum depth of chat calls!"})
     model = tool_input.get("model", "llama3.1:8b")
     message = tool_input['message']
-    messages = [
-        {"role": "system", "content": """\
-You are a chat bot that responds directly to the human user.
-In some cases, the user may make a request that requires the use of tools.
-You have access to a strict list of tools.
-Tool outputs are not visible to the user, so you should read their output to answer the user's prompt.
-When invoking a tool, you must pick one from the provided list."""},
-        {"role": "user", "content": f"{message}"},
-    ]
+    session_id, session = open_session(tool_input.get("session_id"))
+    if not session['lock'].acquire(blocking=False):
+        return jsonify({'error': f"Session {session_id} is busy"}), 409
+    # Turns are only appended, so the history stays a stable prefix that Ollama's prompt cache can reuse.
+    messages = session['messages']
+    turn_start = len(messages)
+    messages.append({"role": "user", "content": f"{message}"})
     temperature = tool_input.get("temperature", 0)
-    model_response = ollama(messages, model, temperature)
-    while 'tool_calls' in model_response['message']:
-        messages.append(model_response['message'])
-        for tool_call in model_response['message']['tool_calls']:
-            invoked_name = tool_call["function"]["name"]
-            # LLMs like to respond with a tool, so we give it one.
-            if invoked_name == "request_tool":
-                messages.append(request_tool(tool_call))
-            else:
-                messages.append(call_tool(tool_call, tool_depth))
+    if tool_input.get("stream", False):
+        response = Response(stream_with_context(stream_chat(session_id, session, turn_start, model, temperature, tool_depth)), mimetype='application/x-ndjson')
+        response.headers['X-Tool-Depth'] = tool_depth
+        response.headers['X-Session-Id'] = session_id
+        return response
+    try:
         model_response = ollama(messages, model, temperature)
+        while 'tool_calls' in model_response['message']:
+            messages.append(model_response['message'])
+            messages.extend(call_tools(model_response['message']['tool_calls'], tool_depth))
+            model_response = ollama(messages, model, temperature)
+        messages.append(model_response['message'])
+    except Exception:
+        del messages[turn_start:]
+        raise
+    finally:
+        session['lock'].release()
 
-    response = make_response(jsonify({'content': model_response['message']['content']}))
+    response = make_response(jsonify({'content': model_response['message']['content'], 'session_id': session_id}))
     response.headers['X-Tool-Depth'] = tool_depth
+    response.headers['X-Session-Id'] = session_id
     return response
 
 
+def stream_chat(session_id, session, turn_start, model, temperature, tool_depth):
+    """Forward the model's text as NDJSON chunks, running tool calls whenever a turn ends with some."""
+    messages = session['messages']
+    try:
+        while True:
+            message = {"role": "assistant", "content": ""}
+            for chunk in ollama_stream(messages, model, temperature):
+                delta = chunk.get("message", {})
+                if delta.get("content"):
+                    message["content"] += delta["content"]
+                    yield json.dumps({'content': delta["content"]}) + '\n'
+                if delta.get("tool_calls"):
+                    message.setdefault("tool_calls", []).extend(delta["tool_calls"])
+            messages.append(message)
+            if "tool_calls" not in message:
+                break
+            messages.extend(call_tools(message["tool_calls"], tool_depth))
+        yield json.dumps({'content': message["content"], 'session_id': session_id, 'done': True}) + '\n'
+    except Exception:
+        del messages[turn_start:]
+        app.logger.error(f"Error streaming chat:\n{traceback.format_exc()}")
+        yield json.dumps({'error': traceback.format_exc(), 'session_id': session_id, 'done': True}) + '\n'
+    finally:
+        session['lock'].release()
+
+
+def open_session(session_id=None):
+    """Return the session with this id, or a new one, after expiring idle sessions."""
+    now = time.monotonic()
+    with sessions_lock:
+        while sessions:
+            oldest_id, oldest = next(iter(sessions.items()))
+            if now - oldest['last_used'] < session_ttl:
+                break
+            app.logger.info(f"Expiring session {oldest_id}")
+            del sessions[oldest_id]
+        if session_id not in sessions:
+            session_id = session_id or uuid.uuid4().hex
+            sessions[session_id] = {
+                'messages': [{"role": "system", "content": system_prompt}],
+                'lock': threading.Lock(),
+            }
+        session = sessions[session_id]
+        session['last_used'] = now
+        sessions.move_to_end(session_id)
+        while len(sessions) > max_sessions:
+            evicted_id, _ = sessions.popitem(last=False)
+            app.logger.info(f"Evicting session {evicted_id}")
+    return session_id, session
+
+
+@app.route('/stats', methods=['GET'])
+def stats_route():
+    return jsonify({
+        'http': http_client.stats(),
+        'response_cache': response_cache.stats(),
+        'tool_results': dict(tool_results_stats, entries=len(tool_results)),
+        'context': context_stats,
+        'outstanding': dict(outstanding),
+    })
+
+
 @app.route('/tools', methods=['GET'])
 def get_tools_route():
     return get_tools()
 
 
 def get_tools():
+    tools, _ = catalog.get()
+    return tools
+
+
+def convert_tools(objects):
     """Convert OpenAPI Objects to Ollama tools."""
     tools = []
-    for name, openapi in openapi_objects.items():
+    for name, openapi in objects.items():
         paths = openapi.get("paths", {})
         for path, operations in paths.items():
             for method, operation in operations.items():
-                tool_name = operation.get("operationId", f"{method}_{path.strip('/').replace('/', '_')}")
+                tool_name = operation_name(method, path, operation)
                 if tool_name in tool_blacklist:
                     continue
-                app.logger.info(f"Defining tool {tool_name}")
+                app.logger.debug("Defining tool %s", tool_name)
                 description = operation.get("summary", f"{method.upper()} {path}")
                 parameters = operation.get("parameters", [])
                 request_schema = operation.get("requestBody", {}).get("application/json", {}).get("schema", {})
@@ -244,28 +700,111 @@ def get_tools():
     return tools
 
 
-def ollama(messages, model, temperature):
-    data = {
+def chat_request(messages, model, temperature, stream):
+    return {
         "model": model,
         "messages": messages,
-        "tools": get_tools(),
-        "stream": False,
+        "stream": stream,
+        "keep_alive": ollama_keep_alive,
         "options": {
             "temperature": temperature,
         }
     }
 
-    app.logger.info(f"POST {OLLAMA_API_URL}\n{json.dumps(data, indent=4)}")
-    response = requests.post(OLLAMA_API_URL, json=data)
+
+def budget_messages(messages, tools_json):
+    """Compact tool outputs so that the messages and tools fit in the context budget."""
+    tools_tokens = sum(len(tool_json) for tool_json in tools_json) // chars_per_token
+    fitted, before, after = fit_messages(messages, context_token_budget - tools_tokens, max_tool_output_chars)
+    with context_stats_lock:
+        context_stats["requests"] += 1
+        if after < before:
+            context_stats["compacted"] += 1
+            context_stats["tokens_saved"] += before - after
+    if after < before:
+        app.logger.info(f"Compacted context from {before} to {after} tokens, {tools_tokens} tokens of tools")
+    return fitted
+
+
+def ollama(messages, model, temperature):
+    _, tools_json = catalog.select(*tool_query(messages))
+    data = chat_request(budget_messages(messages, tools_json), model, temperature, stream=False)
+    key = cache_key(data, tools_json) if temperature == 0 else None
+    cached = key and response_cache.get(key)
+    if cached:
+        app.logger.info(f"Model response from cache {key}")
+        return cached
+
+    app.logger.info(f"POST {OLLAMA_API_URL} model={model} messages={len(messages)} tools={len(tools_json)} generation={catalog.generation}")
+    log_payload("Model request", data)
+    start = time.monotonic()
+    response = http_client.session.post(OLLAMA_API_URL, data=encode_chat_request(data, tools_json), headers={'Content-Type': 'application/json'})
     response.raise_for_status()
-    app.logger.info(f"Model response:\n{json.dumps(response.json(), indent=4)}")
-    return response.json()
+    model_response = response.json()
+    app.logger.info(f"Model response in {time.monotonic() - start:.3f}s: {describe_message(model_response['message'])}")
+    log_payload("Model response", model_response)
+    if key:
+        response_cache.put(key, model_response)
+    return model_response
+
+
+def ollama_stream(messages, model, temperature):
+    """Yield the chunks of Ollama's NDJSON stream as they arrive."""
+    _, tools_json = catalog.select(*tool_query(messages))
+    data = chat_request(budget_messages(messages, tools_json), model, temperature, stream=True)
+    key = cache_key(data, tools_json) if temperature == 0 else None
+    cached = key and response_cache.get(key)
+    if cached:
+        app.logger.info(f"Model response from cache {key}")
+        yield cached
+        return
+
+    app.logger.info(f"POST {OLLAMA_API_URL} stream model={model} messages={len(messages)} tools={len(tools_json)} generation={catalog.generation}")
+    log_payload("Model request", data)
+    message = {"role": "assistant", "content": ""}
+    with http_client.session.post(OLLAMA_API_URL, data=encode_chat_request(data, tools_json), headers={'Content-Type': 'application/json'}, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                chunk = json.loads(line)
+                delta = chunk.get("message", {})
+                message["content"] += delta.get("content", "")
+                if delta.get("tool_calls"):
+                    message.setdefault("tool_calls", []).extend(delta["tool_calls"])
+                yield chunk
+                if chunk.get("done"):
+                    app.logger.info(f"Model response streamed: {describe_message(message)}")
+                    log_payload("Model response", message)
+                if key and chunk.get("done"):
+                    # Cached like a non-streamed response, which replays as a single chunk
+                    response_cache.put(key, dict(chunk, message=message))
+
+
+def encode_chat_request(data, tools_json):
+    """Serialize an Ollama request, splicing in the tools that were serialized once per catalog generation."""
+    body = json.dumps(data)
+    return f'{body[:-1]}, "tools": [{", ".join(tools_json)}]}}'.encode('utf-8')
+
+
+def describe_message(message):
+    if message.get("tool_calls"):
+        return "tool calls " + ", ".join(tool_call["function"]["name"] for tool_call in message["tool_calls"])
+    return f"{len(message.get('content', ''))} characters"
+
+
+def log_payload(description, payload):
+    """Log a payload at DEBUG as compact, truncated JSON; nothing is serialized when DEBUG is off."""
+    if app.logger.isEnabledFor(logging.DEBUG) and random.random() < log_sample_rate:
+        text = json.dumps(payload, separators=(',', ':'))
+        if len(text) > log_payload_chars:
+            text = f"{text[:log_payload_chars]}... ({len(text) - log_payload_chars} more characters)"
+        app.logger.debug("%s %s", description, text)
 
 
 def get_schema(url):
     openapi = f'{url}/openapi.json'
     app.logger.info(f"GET {openapi}")
-    return requests.get(openapi).json()
+    return http_client.session.get(openapi).json()
 
 
 if __name__ == '__main__':
@@ -274,10 +813,15 @@ if __name__ == '__main__':
         # sys.stdin.read() returns a single line in PyCharm, so we loop
         input_data = [line for line in iter(sys.stdin.readline, '')]
         boot = json.loads(''.join(input_data))
-        app.logger.info(json.dumps(boot, indent=4))
+        log_payload("Boot", boot)
+        servers_by_tool = {}
         for server in boot["servers"]:
-            openapi_objects[server['x-tool']] = get_schema(server["url"])
-            app.logger.info(f"Received {server['x-tool']}")
+            servers_by_tool.setdefault(server['x-tool'], []).append(server)
+        servers_by_tool.pop(self_name, None)
+        for tool_name, servers in servers_by_tool.items():
+            # Each replica of a tool serves the same schema, listing only its own server.
+            register_schema(tool_name, dict(get_schema(servers[0]["url"]), servers=servers))
+            app.logger.info(f"Received {tool_name}, {len(servers)} servers")
     except JSONDecodeError as e:
         app.logger.error(f"Failed to parse boot JSON\n{traceback.format_exc()}")
-    app.run(port=port)
+    app.run(host=os.environ.get('TOOL_HOST', '127.0.0.1'), port=port)
@@ -0,0 +1,96 @@
+"""Cache of Ollama responses for deterministic (temperature 0) requests.
+
+Responses are kept serialized in a memory LRU, and optionally in a directory of JSON files. Both layers evict the least
+recently used entries once they exceed their size in bytes.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def cache_key(data, tools_json):
+    """Hash everything that determines the response: model, messages, options and the tool catalog."""
+    digest = hashlib.sha256()
+    request = {key: value for key, value in data.items() if key not in ('stream', 'keep_alive')}
+    digest.update(json.dumps(request, sort_keys=True).encode('utf-8'))
+    for tool_json in tools_json:
+        digest.update(tool_json.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_memory_bytes, directory=None, max_disk_bytes=0):
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = directory
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.max_disk_bytes = max_disk_bytes
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            entries = [entry for entry in os.scandir(directory) if entry.name.endswith('.json')]
+            for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+                self.disk[entry.name[:-len('.json')]] = entry.stat().st_size
+                self.disk_bytes += entry.stat().st_size
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return json.loads(self.memory[key])
+            if key in self.disk:
+                try:
+                    with open(self.path(key), 'r', encoding='utf-8') as f:
+                        serialized = f.read()
+                    os.utime(self.path(key))
+                except OSError:
+                    self.disk_bytes -= self.disk.pop(key)
+                else:
+                    self.disk.move_to_end(key)
+                    self.counters['disk_hits'] += 1
+                    self.remember(key, serialized)
+                    return json.loads(serialized)
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, key, response):
+        serialized = json.dumps(response)
+        with self.lock:
+            self.remember(key, serialized)
+            if self.directory and key not in self.disk:
+                with open(self.path(key), 'w', encoding='utf-8') as f:
+                    f.write(serialized)
+                self.disk[key] = len(serialized)
+                self.disk_bytes += len(serialized)
+                while self.disk_bytes > self.max_disk_bytes and self.disk:
+                    evicted, size = self.disk.popitem(last=False)
+                    self.disk_bytes -= size
+                    self.counters['evictions'] += 1
+                    try:
+                        os.remove(self.path(evicted))
+                    except FileNotFoundError:
+                        pass
+
+    def remember(self, key, serialized):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = serialized
+        self.memory_bytes += len(serialized)
+        while self.memory_bytes > self.max_memory_bytes and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.counters['evictions'] += 1
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, memory_entries=len(self.memory), memory_bytes=self.memory_bytes,
+                        disk_entries=len(self.disk), disk_bytes=self.disk_bytes)
@@ -72,4 +72,4 @@ def create_tool():
 
 
 if __name__ == '__main__':
-    app.run(port=port)
+    app.run(host=os.environ.get('TOOL_HOST', '127.0.0.1'), port=port)
@@ -1,9 +1,13 @@
+import hashlib
 import logging
 import re
 import subprocess
 import sys
 import os
-from flask import Flask, request, jsonify
+import threading
+import time
+from collections import defaultdict
+from flask import Flask, request, jsonify, make_response
 
 port = int(sys.argv[1])
 servers = {}
@@ -47,6 +51,13 @@ self_schema = {
 app = Flask('inspect_tool')
 servers["inspect_tool"] = self_schema
 
+# Response of each tool directory, kept until git's index or one of its tracked files changes
+tree_cache = {}
+tree_cache_lock = threading.Lock()
+# Seconds during which a cached response is served without checking the files again
+revalidate_seconds = float(os.environ.get('INSPECT_REVALIDATE_SECONDS', 1))
+git_dirs = {}
+
 
 @app.route('/openapi.json', methods=['GET'])
 def identify():
@@ -60,7 +71,62 @@ def inspect_tool(tool_name: str):
     tool_dir = os.path.join(tools_dir, tool_name)
     if not os.path.exists(tool_dir):
         return jsonify({'error': f'Tool {tool_name} does not exist'}), 404
-    return jsonify({'tool_name': tool_name, 'code': generate_tree_dict(tool_dir)})
+    entry = cached_inspection(tool_name, tool_dir)
+    response = make_response(entry['body'])
+    response.content_type = 'application/json'
+    response.set_etag(entry['etag'])
+    # Answers 304 Not Modified, without the body, when the client's If-None-Match has the ETag
+    return response.make_conditional(request)
+
+
+def cached_inspection(tool_name, tool_dir):
+    """Return the cached response for a tool, rebuilding it only when the files it was built from changed."""
+    now = time.monotonic()
+    with tree_cache_lock:
+        entry = tree_cache.get(tool_dir)
+    if entry and now - entry['validated_at'] < revalidate_seconds:
+        return entry
+    # Checked before reading the files, so that a change made while building is seen by the next request
+    index_mtime = git_index_mtime(tool_dir)
+    if entry and entry['index_mtime'] == index_mtime and file_stats(tool_dir, entry['tracked_files']) == entry['stats']:
+        entry['validated_at'] = now
+        return entry
+    tracked_files = get_git_tracked_files(tool_dir)
+    stats = file_stats(tool_dir, tracked_files)
+    body = jsonify({'tool_name': tool_name, 'code': generate_tree_dict(tool_dir, tracked_files)}).get_data()
+    entry = {
+        'body': body,
+        'etag': hashlib.sha256(body).hexdigest(),
+        'index_mtime': index_mtime,
+        'tracked_files': tracked_files,
+        'stats': stats,
+        'validated_at': now,
+    }
+    with tree_cache_lock:
+        tree_cache[tool_dir] = entry
+    return entry
+
+
+def git_index_mtime(path):
+    """Modification time of git's index, which changes whenever files are added, removed or committed."""
+    if path not in git_dirs:
+        result = subprocess.run(["git", "rev-parse", "--absolute-git-dir"], cwd=path, text=True, capture_output=True)
+        git_dirs[path] = result.stdout.strip() if result.returncode == 0 else None
+    try:
+        return os.stat(os.path.join(git_dirs[path], 'index')).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+
+def file_stats(path, tracked_files):
+    stats = {}
+    for tracked_file in tracked_files:
+        try:
+            stat = os.stat(os.path.join(path, tracked_file))
+            stats[tracked_file] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stats[tracked_file] = None
+    return stats
 
 
 def get_git_tracked_files(path):
@@ -80,20 +146,26 @@ def get_git_tracked_files(path):
         return set()
 
 
-def build_tree_dict(path, tracked_files, base_path):
+def index_directories(tracked_files):
+    """Map each directory holding tracked files ('' for the root) to its entries, and whether each is a directory."""
+    directories = defaultdict(dict)
+    for tracked_file in tracked_files:
+        parts = tracked_file.split('/')
+        for depth, name in enumerate(parts):
+            directories['/'.join(parts[:depth])][name] = depth < len(parts) - 1
+    return directories
+
+
+def build_tree_dict(path, directories, relative_path=''):
     """Build a dictionary representing the directory tree, including file contents."""
     tree = {}
-    items = sorted(os.listdir(path))
-
-    for item in items:
-        item_path = os.path.join(path, item)
-        relative_item_path = os.path.relpath(item_path, base_path)
+    for item, is_dir in sorted(directories[relative_path].items()):
+        relative_item_path = f'{relative_path}/{item}' if relative_path else item
+        item_path = os.path.join(path, relative_item_path)
 
-        if os.path.isdir(item_path):
-            # Check if any tracked file exists in this directory or its subdirectories
-            if any(f.startswith(relative_item_path + os.sep) for f in tracked_files):
-                tree[item] = build_tree_dict(item_path, tracked_files, base_path)
-        elif os.path.isfile(item_path) and relative_item_path in tracked_files:
+        if is_dir:
+            tree[item] = build_tree_dict(path, directories, relative_item_path)
+        elif os.path.isfile(item_path):
             # Read file content
             try:
                 with open(item_path, 'r', encoding='utf-8') as f:
@@ -105,15 +177,13 @@ def build_tree_dict(path, tracked_files, base_path):
     return tree
 
 
-def generate_tree_dict(path="."):
+def generate_tree_dict(path, tracked_files):
     """Generate a dictionary representation of the directory tree with Git-tracked files and their contents."""
-    tracked_files = get_git_tracked_files(path)
     if not tracked_files:
         return {}
 
-    tree_dict = build_tree_dict(path, tracked_files, path)
-    return tree_dict
+    return build_tree_dict(path, index_directories(tracked_files))
 
 
 if __name__ == '__main__':
-    app.run(port=port)
+    app.run(host=os.environ.get('TOOL_HOST', '127.0.0.1'), port=port)
@@ -71,4 +71,4 @@ def list_tool_versions():
 
 
 if __name__ == '__main__':
-    app.run(port=port)
+    app.run(host=os.environ.get('TOOL_HOST', '127.0.0.1'), port=port)
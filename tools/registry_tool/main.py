@@ -1,3 +1,5 @@
+import hashlib
+import importlib.util
 import json
 import logging
 import os
@@ -5,14 +7,23 @@ import signal
 import socket
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
 from pathlib import Path
 from time import sleep
-from typing import Dict
+from typing import Dict, List
+from urllib.parse import urlsplit
 
 import requests
-from flask import Flask, request, jsonify
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from flask import Flask, Response, request, jsonify, redirect
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import http_client
+from tool_catalog import ToolCatalog
 
 self_name = 'registry_tool'
 self_description = "Registry that can list tools and start them. The URL of each started tools is available through the list_tools operation."
@@ -26,53 +37,879 @@ processes = {}
 # OpenAPI Object for each tool
 openapi_objects: Dict[str, Dict] = {}
 
+# Startup timings of each tool, kept across restarts
+tool_stats: Dict[str, Dict] = {}
+
+# Starts in progress; concurrent requests to start the same tool wait on the same Future.
+in_flight: Dict[str, Future] = {}
+
+# Tools that exited or stopped answering, with the time of their next restart
+crashed: Dict[str, Dict] = {}
+
+# Consecutive crashes of each tool, which set its restart backoff; kept across successful restarts, so that a tool that
+# crashes soon after each restart backs off, and reset once it stays up for restart_max_delay seconds.
+crash_attempts: Dict[str, int] = {}
+
+# Tools stopped for being idle, with the time they were stopped
+evicted: Dict[str, float] = {}
+
+# Number of replicas wanted per tool, 1 if not set; kept across restarts and evictions.
+replica_counts: Dict[str, int] = {}
+
+# SHA-256 of the main.py of each hosted tool and its git revision, as it was imported
+hosted_versions: Dict[str, Dict] = {}
+
+# Git revision of the last version of each tool that failed to start during a hot swap, so that it isn't retried
+failed_revisions: Dict[str, str] = {}
+
+# Replaced versions of tools, waiting for their callers to be done before they are stopped
+draining: List[Dict] = []
+
+# Guards processes, openapi_objects, tool_stats, in_flight and replica_counts. Never held while waiting on a tool.
+registry_lock = threading.Lock()
+# Serializes scaling, so that two callers don't both start the missing replicas.
+scale_lock = threading.Lock()
+# Upper bound of the replicas of a tool; scale_tool is in the registry's schema, so the LLM can call it.
+max_replicas = int(os.environ.get('REGISTRY_MAX_REPLICAS', 8))
+
 app = Flask(self_name)
 port = int(sys.argv[1])
 
-retry_strategy = Retry(connect=10, backoff_factor=1)
+# Trusted tools imported into the registry's process and served under /tools/<name>, instead of running in their own
+# process. Tools created by the LLM must not be listed here, since they would run with the registry's privileges.
+# chat reads the servers of the other tools from its stdin at boot, so it always runs in its own process.
+hosted_tool_names = set(filter(None, os.environ.get('REGISTRY_IN_PROCESS_TOOLS', '').split(','))) - {'chat'}
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app)
+# WSGI app of each hosted tool, by mount path; dispatched before the registry's own routes.
+hosted_apps: Dict[str, 'HostedApp'] = app.wsgi_app.mounts
+# Hosting imports a tool with the registry's sys.argv and sys.path patched, one tool at a time.
+hosting_lock = threading.Lock()
 
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session = requests.Session()
-session.mount("http://", adapter)
+# Tool directories and the metadata of their main.py, refreshed when their files change
+catalog = ToolCatalog()
 
+session = http_client.session
 
-def start_tool(tool_name):
-    tool_port = find_free_port()
-    app.logger.info(f"Starting '{tool_name}' on port {tool_port}")
-    process = subprocess.Popen(
-        ['python', 'main.py', str(tool_port)],
-        cwd=os.path.join('..', tool_name),
-        stdin=subprocess.PIPE
-    )
-    servers = [srv for openapi in openapi_objects.values() for srv in openapi["servers"]]
-    process.stdin.write(json.dumps({'servers': servers}).encode('utf-8'))
-    process.stdin.close()
-    sleep(1)
-    return register_tool_process(tool_port, process, tool_name)
+# Readiness probes must fail fast, so they don't share the retrying session.
+probe_session = http_client.new_session(retries=0)
+
+# Seconds a tool has to serve its schema after being spawned.
+ready_timeout = float(os.environ.get('REGISTRY_READY_TIMEOUT', 30))
+ready_initial_delay = 0.02
+ready_max_delay = 0.5
+# A tool that exits before becoming ready is spawned again on another port, in case its port was taken meanwhile.
+spawn_attempts = 3
+
+# The supervisor checks each started tool every interval, and restarts crashed tools with exponential backoff.
+supervise_interval = float(os.environ.get('REGISTRY_SUPERVISE_INTERVAL', 2))
+max_health_failures = 3
+restart_initial_delay = 1.0
+restart_max_delay = 60.0
+stopping = threading.Event()
+
+# When a commit changes a running tool's main.py, the supervisor starts the new version next to the old one and switches
+# to it once ready. Behind the gateway, the old version is stopped once its requests in progress are done, or after
+# drain_timeout seconds. Otherwise the registry can't see the requests sent to its URL, so the old version is stopped
+# after swap_grace seconds, which by default outlasts the read timeout of the callers' requests.
+hot_swap_enabled = os.environ.get('REGISTRY_HOT_SWAP', '1') == '1'
+swap_grace = float(os.environ.get('REGISTRY_SWAP_GRACE', http_client.timeout[1] + 5))
+drain_timeout = float(os.environ.get('REGISTRY_DRAIN_TIMEOUT', 60))
+# Tools keeping state in memory, like chat's sessions, which a new process would lose
+stateful_tools = {'chat'}
+
+# Started tools are stopped after idle_timeout seconds without use, and the least recently used ones are stopped
+# while their resident memory exceeds the budget. 0 disables either policy.
+idle_timeout = float(os.environ.get('REGISTRY_IDLE_TIMEOUT', 1800))
+memory_budget_bytes = int(float(os.environ.get('REGISTRY_MEMORY_BUDGET_MB', 0)) * 1024 * 1024)
+pinned_tools = set(filter(None, os.environ.get('REGISTRY_PINNED_TOOLS', 'chat').split(',')))
+# Stateful and pinned tools are only swapped by /restart, never on a commit.
+manual_swap_tools = stateful_tools | pinned_tools
+
+# Fork tools from a warm parent process instead of spawning a fresh interpreter for each of them.
+zygote_enabled = os.environ.get('REGISTRY_ZYGOTE') == '1'
+zygote = None
+zygote_lock = threading.Lock()
+
+# With the unix transport, tools listen on a Unix socket in runtime_dir instead of a TCP port, and their schemas advertise
+# an http+unix:// URL, which http_client sessions can dial.
+transport = os.environ.get('REGISTRY_TRANSPORT', 'tcp')
+runtime_dir = os.environ.get('REGISTRY_RUNTIME_DIR', os.path.join(tempfile.gettempdir(), f'bot-registry-{port}'))
+
+# The started tools are saved in the state file, so that the next registry on this port reattaches to those still
+# running. With keep_tools, shutting down leaves the tools running instead of stopping them.
+state_file = os.environ.get('REGISTRY_STATE_FILE', os.path.join(runtime_dir, 'state.json'))
+keep_tools = os.environ.get('REGISTRY_KEEP_TOOLS') == '1'
+saved_state = None
+
+# Serve tools under /tools/<name>/ on the registry's port, proxying to their replicas over pooled connections.
+gateway_enabled = os.environ.get('REGISTRY_GATEWAY') == '1'
+# Headers that apply to a single connection, which the gateway doesn't forward.
+hop_by_hop_headers = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+                      'transfer-encoding', 'upgrade', 'host'}
+# Response headers werkzeug sets itself, which would otherwise be repeated.
+server_headers = {'server', 'date'}
+
+
+class ToolStartError(RuntimeError):
+    """A tool process exited or did not become ready before its deadline."""
+
+
+class ToolExitedError(ToolStartError):
+    """A tool process exited before becoming ready."""
+
+
+def ensure_started(tool_names: List[str]):
+    """Start the tools that aren't running, joining the starts already in flight.
+
+    Returns the schemas of the tools that are running, and the errors of those that failed to start.
+    """
+    owned = []
+    pending = {}
+    # Copied while locked, since a tool may crash or be evicted before they are returned
+    schemas = {}
+    for tool_name in tool_names:
+        reap_if_exited(tool_name)
+    with registry_lock:
+        for tool_name in dict.fromkeys(tool_names):
+            if tool_name in openapi_objects:
+                touch(tool_name)
+                schemas[tool_name] = openapi_objects[tool_name]
+                continue
+            if tool_name not in in_flight:
+                in_flight[tool_name] = Future()
+                owned.append(tool_name)
+            pending[tool_name] = in_flight[tool_name]
+    if owned:
+        try:
+            started, errors = start_tools(owned)
+        except Exception as e:
+            started, errors = {}, {tool_name: str(e) for tool_name in owned}
+        with registry_lock:
+            for tool_name in owned:
+                del in_flight[tool_name]
+        for tool_name in owned:
+            if tool_name in started:
+                pending[tool_name].set_result(started[tool_name])
+            else:
+                pending[tool_name].set_exception(ToolStartError(errors[tool_name]))
+    errors = {}
+    for tool_name, future in pending.items():
+        try:
+            schemas[tool_name] = future.result()
+        except ToolStartError as e:
+            errors[tool_name] = e.args[0]
+    return schemas, errors
+
+
+def start_tools(tool_names: List[str]):
+    """Spawn all tools first, then wait for each, so the batch is ready in the time of the slowest tool."""
+    launched = {}
+    versions = {}
+    schemas = {}
+    errors = {}
+    for tool_name in tool_names:
+        if tool_name in hosted_tool_names:
+            try:
+                schemas[tool_name] = host_tool(tool_name)
+            except Exception as e:
+                app.logger.exception(f"Failed to host '{tool_name}'")
+                errors[tool_name] = f"{type(e).__name__}: {e}"
+            continue
+        # Read before spawning, so that an edit made while the tool starts is seen as a newer version.
+        versions[tool_name] = source_version(tool_name)
+        try:
+            launched[tool_name] = spawn_tool(tool_name)
+        except (OSError, ToolStartError) as e:
+            app.logger.error(f"Failed to spawn '{tool_name}': {e}")
+            errors[tool_name] = str(e)
+    for tool_name, (url, process, spawned_at) in launched.items():
+        try:
+            url, process, spawned_at, schema = wait_or_respawn(tool_name, url, process, spawned_at)
+        except (OSError, ToolStartError) as e:
+            app.logger.error(str(e))
+            errors[tool_name] = str(e)
+            continue
+        startup_seconds = time.monotonic() - spawned_at
+        app.logger.info(f"'{tool_name}' ready in {startup_seconds:.3f}s")
+        with registry_lock:
+            tool_stats.setdefault(tool_name, new_tool_stats()).update({
+                'spawn_mode': 'zygote' if zygote_enabled else 'popen',
+                'startup_seconds': round(startup_seconds, 4),
+            })
+        schemas[tool_name] = register_tool_process(url, process, tool_name, schema, versions[tool_name])
+    return schemas, errors
+
+
+def host_tool(tool_name, reload=False):
+    """Import a trusted tool's Flask app into this process and serve it under /tools/<name>, returning its schema.
+
+    With reload, the tool is imported again and replaces the running version only if the import succeeds.
+    """
+    started_at = time.monotonic()
+    path = os.path.abspath(os.path.join('..', tool_name, 'main.py'))
+    with hosting_lock:
+        version = source_version(tool_name)
+        if f'/tools/{tool_name}' in hosted_apps and not reload:
+            tool_app = hosted_apps[f'/tools/{tool_name}'].tool_app
+        else:
+            # A unique module name, so tools don't replace each other's main in sys.modules
+            spec = importlib.util.spec_from_file_location(f'hosted_tools.{tool_name}', path)
+            module = importlib.util.module_from_spec(spec)
+            argv = sys.argv
+            # Tools read their port from argv; their URL is replaced below anyway.
+            sys.argv = [path, str(port)]
+            sys.path.insert(0, os.path.dirname(path))
+            try:
+                spec.loader.exec_module(module)
+            finally:
+                sys.argv = argv
+                sys.path.remove(os.path.dirname(path))
+            sys.modules[spec.name] = module
+            tool_app = module.app
+    url = f'http://127.0.0.1:{port}/tools/{tool_name}'
+    schema = tool_app.test_client().get('/openapi.json').get_json()
+    servers = [dict(server, url=url) for server in schema.get('servers', [])[:1]] or [{'url': url, 'x-tool': tool_name}]
+    schema = with_servers(schema, servers)
+    hosted_apps[f'/tools/{tool_name}'] = HostedApp(tool_name, tool_app)
+    hosted_versions[tool_name] = version
+    startup_seconds = time.monotonic() - started_at
+    app.logger.info(f"Hosting '{tool_name}' in process at {url}, imported in {startup_seconds:.3f}s")
+    with registry_lock:
+        openapi_objects[tool_name] = schema
+        tool_stats.setdefault(tool_name, new_tool_stats()).update({
+            'spawn_mode': 'in-process',
+            'startup_seconds': round(startup_seconds, 4),
+        })
+        tool_stats[tool_name]['starts'] += 1
+    return schema
+
+
+class HostedApp:
+    """WSGI app of a hosted tool, serving its published schema instead of the one the tool builds: the tool describes
+    itself at the root URL of the port it was given, without its /tools/<name> prefix."""
+
+    def __init__(self, tool_name, tool_app):
+        self.tool_name = tool_name
+        self.tool_app = tool_app
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == '/openapi.json':
+            with registry_lock:
+                published = openapi_objects.get(self.tool_name)
+            if published is not None:
+                return Response(json.dumps(published), mimetype='application/json')(environ, start_response)
+        return self.tool_app(environ, start_response)
+
+
+def spawn_tool(tool_name):
+    """Start a tool process, returning the URL it will serve on."""
+    if transport == 'unix':
+        # Tools still expect a port argument, but they bind the socket given by TOOL_HOST.
+        tool_port = 0
+        socket_path = os.path.join(runtime_dir, f'{tool_name}-{uuid.uuid4().hex[:8]}.sock')
+        env = {'TOOL_HOST': f'unix://{socket_path}'}
+        url = http_client.unix_url(socket_path)
+    else:
+        tool_port = find_free_port()
+        env = {}
+        url = f'http://localhost:{tool_port}'
+    app.logger.info(f"Starting '{tool_name}' at {url}")
+    with registry_lock:
+        servers = [srv for openapi in openapi_objects.values() for srv in openapi["servers"]]
+    boot = json.dumps({'servers': servers})
+    argv = ['main.py', str(tool_port)]
+    cwd = os.path.join('..', tool_name)
+    spawned_at = time.monotonic()
+    if zygote_enabled:
+        process = zygote_spawn(cwd, argv, boot, env)
+    else:
+        process = subprocess.Popen(['python'] + argv, cwd=cwd, stdin=subprocess.PIPE, env=dict(os.environ, **env))
+        process.stdin.write(boot.encode('utf-8'))
+        process.stdin.close()
+    return url, process, spawned_at
+
+
+def wait_or_respawn(tool_name, url, process, spawned_at):
+    """Wait until a spawned tool is ready, spawning it again if it exited, e.g. because another process took its port."""
+    for attempt in range(1, spawn_attempts + 1):
+        try:
+            return url, process, spawned_at, wait_until_ready(tool_name, process, url, spawned_at + ready_timeout)
+        except ToolExitedError as e:
+            if attempt == spawn_attempts:
+                raise
+            app.logger.warning(f"{e}, spawning it again")
+            url, process, spawned_at = spawn_tool(tool_name)
+
+
+class ForkedProcess:
+    """Popen-like handle for a process that isn't a child of the registry: forked by the zygote, which reaps its own
+    children, or left running by a previous registry."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self.returncode = -1
+            else:
+                if process_state(self.pid) == 'Z':
+                    # Exited, but its parent hasn't reaped it yet
+                    self.returncode = -1
+        return self.returncode
 
+    def terminate(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
 
-def register_tool_process(tool_port, process, tool_name):
-    url = f'http://localhost:{tool_port}'
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(f"pid {self.pid}", timeout)
+            sleep(0.01)
+        return self.returncode
+
+
+def process_state(pid):
+    """State letter of a process from /proc, e.g. 'S' or 'Z' for a zombie; None if it can't be read."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rpartition(')')[2].split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def start_zygote():
+    app.logger.info("Starting zygote")
+    return subprocess.Popen(['python', 'zygote.py'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+
+def zygote_spawn(cwd, argv, boot, env):
+    """Ask the zygote to fork a tool, restarting the zygote if it died."""
+    global zygote
+    with zygote_lock:
+        if zygote is None or zygote.poll() is not None:
+            zygote = start_zygote()
+        zygote.stdin.write(json.dumps({'cwd': cwd, 'argv': argv, 'stdin': boot, 'env': env}) + '\n')
+        zygote.stdin.flush()
+        reply = json.loads(zygote.stdout.readline() or '{"error": "zygote exited"}')
+    if 'error' in reply:
+        raise ToolStartError(f"Zygote failed to fork {argv}: {reply['error']}")
+    return ForkedProcess(reply['pid'])
+
+
+def wait_until_ready(tool_name, process, url, deadline):
+    """Poll the tool's schema with exponential backoff until it answers, the process exits, or the deadline passes."""
+    delay = ready_initial_delay
+    while True:
+        exit_code = process.poll()
+        if exit_code is not None:
+            raise ToolExitedError(f"'{tool_name}' exited with code {exit_code} before becoming ready")
+        try:
+            response = probe_session.get(f'{url}/openapi.json', timeout=ready_max_delay)
+            if response.ok:
+                return response.json()
+        except (requests.RequestException, ValueError):
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            process.terminate()
+            process.wait()
+            raise ToolStartError(f"'{tool_name}' did not become ready within {ready_timeout}s")
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, ready_max_delay)
+
+
+def register_tool_process(url, process, tool_name, schema, version):
     app.logger.info(f"Registering '{tool_name}' at {url}")
-    tool = get_tool_handle(url, tool_name)
-    tool.update({'process': process})
-    processes[tool_name] = tool
-    openapi_objects[tool_name] = tool['get']('/openapi.json')
-    return openapi_objects[tool_name]
+    tool = get_tool_handle(tool_name)
+    tool.update({'replicas': [new_replica(url, process, schema)], 'started_at': time.time(), 'last_used': time.monotonic()})
+    tool.update(version)
+    with registry_lock:
+        processes[tool_name] = tool
+        openapi_objects[tool_name] = schema = replicated_schema(tool_name, schema)
+        tool_stats[tool_name]['starts'] += 1
+        restarted = crashed.pop(tool_name, None)
+        if restarted:
+            tool_stats[tool_name]['restarts'] += 1
+        evicted.pop(tool_name, None)
+    if restarted:
+        publish_schema(tool_name, schema)
+    return schema
+
+
+def new_replica(url, process, schema):
+    """One process of a tool; server is the OpenAPI Server object it reported for itself."""
+    server = schema['servers'][0]
+    if transport == 'unix':
+        # The tool only knows the port it was given
+        server = dict(server, url=url)
+    return {'process': process, 'url': url, 'server': server, 'started_at': time.time(),
+            'schema_sha256': schema_hash(schema), 'health_failures': 0, 'in_flight': 0}
+
+
+def schema_hash(schema):
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_state():
+    """Write the started tools to the state file, if they changed since it was last written."""
+    global saved_state
+    with registry_lock:
+        state = {
+            'tools': {
+                tool_name: {
+                    'started_at': tool['started_at'],
+                    'sha256': tool['sha256'],
+                    'revision': tool['revision'],
+                    'schema': openapi_objects[tool_name],
+                    'replicas': [{
+                        'pid': replica['process'].pid,
+                        'url': replica['url'],
+                        'started_at': replica['started_at'],
+                        'schema_sha256': replica['schema_sha256'],
+                    } for replica in tool['replicas']],
+                } for tool_name, tool in processes.items() if tool_name in openapi_objects
+            },
+            'replica_counts': replica_counts,
+        }
+        serialized = json.dumps(state, indent=2)
+    if serialized == saved_state:
+        return
+    temporary = f'{state_file}.tmp'
+    with open(temporary, 'w') as f:
+        f.write(serialized)
+    os.replace(temporary, state_file)
+    saved_state = serialized
+
+
+def reattach():
+    """Adopt the tools left running by the previous registry on this port, instead of starting them again.
+
+    A replica is adopted if its pid is alive and its URL serves the same schema as when it was saved.
+    """
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return
+    replica_counts.update(state.get('replica_counts', {}))
+    for tool_name, saved in state.get('tools', {}).items():
+        replicas = []
+        for saved_replica in saved['replicas']:
+            process = ForkedProcess(saved_replica['pid'])
+            if process.poll() is not None:
+                continue
+            try:
+                schema = probe_session.get(f"{saved_replica['url']}/openapi.json", timeout=ready_max_delay * 4).json()
+            except (requests.RequestException, ValueError):
+                continue
+            if schema_hash(schema) != saved_replica['schema_sha256']:
+                continue  # Something else listens there now
+            replicas.append(dict(new_replica(saved_replica['url'], process, schema), started_at=saved_replica['started_at']))
+        if not replicas:
+            app.logger.info(f"'{tool_name}' is no longer running")
+            continue
+        app.logger.info(f"Reattached to {len(replicas)} replicas of '{tool_name}'")
+        tool = get_tool_handle(tool_name)
+        tool.update({'replicas': replicas, 'started_at': saved['started_at'], 'last_used': time.monotonic(),
+                     'sha256': saved['sha256'], 'revision': saved['revision']})
+        with registry_lock:
+            processes[tool_name] = tool
+            openapi_objects[tool_name] = replicated_schema(tool_name, saved['schema'])
+            tool_stats.setdefault(tool_name, new_tool_stats())['spawn_mode'] = 'reattached'
+
+
+def replicated_schema(tool_name, schema=None):
+    """The tool's schema listing the server of every replica, or the gateway; called with registry_lock held."""
+    replicas = processes[tool_name]['replicas']
+    if gateway_enabled:
+        servers = [dict(replicas[0]['server'], url=f'http://127.0.0.1:{port}/tools/{tool_name}')]
+    else:
+        servers = [replica['server'] for replica in replicas]
+    return with_servers(schema or openapi_objects[tool_name], servers)
+
+
+def with_servers(schema, servers):
+    """The schema with these servers, and the info.url and info.port shown by list_tools pointing at the first one.
+
+    A tool only knows the port it was given, which is 0 on a Unix socket.
+    """
+    url = servers[0]['url']
+    return dict(schema, servers=servers, info=dict(schema.get('info', {}), url=url, port=urlsplit(url).port))
+
+
+def scale(tool_name):
+    """Start or stop replicas of a running tool until it has as many as wanted, returning the errors of failed starts."""
+    with scale_lock:
+        with registry_lock:
+            tool = processes.get(tool_name)
+            if tool is None:
+                return []
+            wanted = 1 if tool_name in stateful_tools else replica_counts.get(tool_name, 1)
+            surplus = tool['replicas'][wanted:]
+            del tool['replicas'][wanted:]
+            missing = wanted - len(tool['replicas'])
+            if surplus:
+                openapi_objects[tool_name] = schema = replicated_schema(tool_name)
+        if surplus:
+            app.logger.info(f"Stopping {len(surplus)} replicas of '{tool_name}'")
+            # Callers stop picking the surplus replicas once they have the new schema.
+            publish_schema(tool_name, schema)
+            for replica in surplus:
+                stop_process(replica['process'])
+        if missing > 0:
+            return add_replicas(tool_name, missing)
+        return []
+
+
+def launch_replicas(tool_name, count):
+    """Spawn processes of a tool and wait until they are ready; returns them, the schema they serve, and the errors."""
+    launched = []
+    errors = []
+    for _ in range(count):
+        try:
+            launched.append(spawn_tool(tool_name))
+        except (OSError, ToolStartError) as e:
+            errors.append(str(e))
+    replicas = []
+    schema = None
+    for url, process, spawned_at in launched:
+        try:
+            url, process, _, schema = wait_or_respawn(tool_name, url, process, spawned_at)
+            replicas.append(new_replica(url, process, schema))
+        except (OSError, ToolStartError) as e:
+            errors.append(str(e))
+    for error in errors:
+        app.logger.error(f"Failed to start a replica of '{tool_name}': {error}")
+    return replicas, schema, errors
+
+
+def add_replicas(tool_name, count):
+    """Start more replicas of a running tool and publish its schema listing them."""
+    app.logger.info(f"Starting {count} more replicas of '{tool_name}'")
+    replicas, _, errors = launch_replicas(tool_name, count)
+    with registry_lock:
+        tool = processes.get(tool_name)
+        if tool is not None and replicas:
+            tool['replicas'].extend(replicas)
+            tool_stats[tool_name]['starts'] += len(replicas)
+            openapi_objects[tool_name] = schema = replicated_schema(tool_name)
+    if tool is None:
+        # The tool crashed or was evicted meanwhile
+        for replica in replicas:
+            stop_process(replica['process'])
+    elif replicas:
+        publish_schema(tool_name, schema)
+    return errors
+
+
+def source_version(tool_name):
+    """SHA-256 of the tool's main.py and the git commit that last changed it; callers read it before starting the tool."""
+    catalog.refresh()
+    source = catalog.get(tool_name)
+    return {'sha256': source['sha256'] if source else None, 'revision': git_revision(tool_name)}
+
+
+def git_revision(tool_name):
+    try:
+        return subprocess.run(
+            ['git', 'log', '-1', '--format=%H', '--', 'main.py'],
+            cwd=os.path.join('..', tool_name), capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def swap_changed_tools():
+    """Hot swap the running tools whose main.py was committed since they were started.
+
+    Edits that aren't committed yet don't trigger a swap, nor do commits of the tools in manual_swap_tools.
+    """
+    sources = catalog.tools()
+    with registry_lock:
+        running = {tool_name: dict(sha256=tool['sha256'], revision=tool['revision']) for tool_name, tool in processes.items()}
+        running.update(hosted_versions)
+    # Only the tools whose file changed can have a new commit, which spares a git process per tool on each pass.
+    edited = [
+        tool_name for tool_name, version in running.items()
+        if tool_name in sources and tool_name not in manual_swap_tools and sources[tool_name]['sha256'] != version['sha256']
+    ]
+    for tool_name in edited:
+        revision = git_revision(tool_name)
+        if revision and revision not in (running[tool_name]['revision'], failed_revisions.get(tool_name)):
+            hot_swap(tool_name, f"commit {revision[:8]} changed its main.py")
+
+
+def hot_swap(tool_name, reason):
+    """Start the new version of a running tool next to the old one, and switch to it once it is ready.
+
+    The old version keeps serving meanwhile, and stays if the new one fails to start. Returns the errors of a failed swap.
+    """
+    app.logger.info(f"Hot swapping '{tool_name}': {reason}")
+    if tool_name in hosted_tool_names:
+        try:
+            schema = host_tool(tool_name, reload=True)
+        except Exception as e:
+            return swap_failed(tool_name, [f"{type(e).__name__}: {e}"], git_revision(tool_name))
+        swapped(tool_name, schema)
+        return []
+    with scale_lock:
+        with registry_lock:
+            old = processes.get(tool_name)
+        if old is None:
+            return [f"'{tool_name}' is not running"]
+        version = source_version(tool_name)
+        replicas, schema, errors = launch_replicas(tool_name, len(old['replicas']))
+        if errors:
+            for replica in replicas:
+                stop_process(replica['process'])
+            return swap_failed(tool_name, errors, version['revision'])
+        tool = get_tool_handle(tool_name)
+        tool.update({'replicas': replicas, 'started_at': time.time(), 'last_used': old['last_used']}, **version)
+        with registry_lock:
+            current = processes.get(tool_name)
+            if current is old:
+                processes[tool_name] = tool
+                openapi_objects[tool_name] = schema = replicated_schema(tool_name, schema)
+                tool_stats[tool_name]['starts'] += len(replicas)
+        if current is not old:
+            # The old version crashed or was evicted meanwhile
+            for replica in replicas:
+                stop_process(replica['process'])
+            return [f"'{tool_name}' stopped during the swap"]
+    swapped(tool_name, schema)
+    threading.Thread(target=drain, args=(tool_name, old), name=f'drain-{tool_name}', daemon=True).start()
+    return []
+
+
+def swapped(tool_name, schema):
+    with registry_lock:
+        tool_stats[tool_name]['swaps'] += 1
+        failed_revisions.pop(tool_name, None)
+    app.logger.info(f"Swapped '{tool_name}' to its new version")
+    publish_schema(tool_name, schema)
+
+
+def swap_failed(tool_name, errors, revision):
+    """Keep the running version of a tool, and don't retry the revision that failed until another commit."""
+    with registry_lock:
+        tool_stats[tool_name]['swap_failures'] += 1
+        failed_revisions[tool_name] = revision
+    app.logger.error(f"New version of '{tool_name}' failed to start, keeping the running one: {errors}")
+    return errors
 
 
-def get_tool_handle(url, tool_name):
+def drain(tool_name, tool):
+    """Stop the replicas of a replaced version once they are done with their requests.
+
+    Only the gateway counts the requests in progress. Without it, callers may still hold the old URL, or wait for a
+    response from it, so the old version gets swap_grace seconds.
+    """
+    with registry_lock:
+        draining.append(tool)
+    if gateway_enabled:
+        deadline = time.monotonic() + drain_timeout
+        while time.monotonic() < deadline and not stopping.is_set():
+            with registry_lock:
+                if not any(replica['in_flight'] for replica in tool['replicas']):
+                    break
+            sleep(0.1)
+    else:
+        app.logger.info(f"Stopping the replaced version of '{tool_name}' in {swap_grace:.0f}s")
+        stopping.wait(swap_grace)
+    with registry_lock:
+        if tool not in draining:
+            return  # Stopped by shutdown
+        draining.remove(tool)
+    app.logger.info(f"Stopping the replaced version of '{tool_name}'")
+    for replica in tool['replicas']:
+        stop_process(replica['process'])
+
+
+def new_tool_stats():
+    return {'starts': 0, 'restarts': 0, 'crashes': 0, 'evictions': 0, 'swaps': 0, 'swap_failures': 0}
+
+
+def touch(tool_name):
+    """Record that a tool is in use; called with registry_lock held."""
+    if tool_name in processes:
+        processes[tool_name]['last_used'] = time.monotonic()
+
+
+def evict_idle():
+    """Stop tools idle for longer than idle_timeout, then the least recently used ones while over the memory budget."""
+    now = time.monotonic()
+    with registry_lock:
+        candidates = sorted(
+            ((tool['last_used'], tool_name) for tool_name, tool in processes.items() if tool_name not in pinned_tools),
+            reverse=True,
+        )
+    if idle_timeout:
+        while candidates and now - candidates[-1][0] > idle_timeout:
+            last_used, tool_name = candidates.pop()
+            evict(tool_name, f"idle for {now - last_used:.0f}s")
+    if memory_budget_bytes:
+        with registry_lock:
+            pids = {tool_name: [replica['process'].pid for replica in tool['replicas']] for tool_name, tool in processes.items()}
+        memory = {tool_name: sum(resident_memory(pid) for pid in tool_pids) for tool_name, tool_pids in pids.items()}
+        used = sum(memory.values())
+        while candidates and used > memory_budget_bytes:
+            _, tool_name = candidates.pop()
+            if tool_name not in memory:
+                continue
+            used -= memory[tool_name]
+            evict(tool_name, f"over the memory budget, {used / 1024 / 1024:.0f} MB used by the other tools")
+
+
+def resident_memory(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def evict(tool_name, reason):
+    with registry_lock:
+        tool = processes.pop(tool_name, None)
+        if tool is None:
+            return
+        openapi_objects.pop(tool_name, None)
+        evicted[tool_name] = time.time()
+        tool_stats[tool_name]['evictions'] += 1
+    app.logger.info(f"Evicting '{tool_name}': {reason}")
+    # Its port may be given to another tool, so chat must not keep sending requests there.
+    publish_schema(tool_name, None)
+    for replica in tool['replicas']:
+        stop_process(replica['process'])
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        os.kill(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def publish_schema(tool_name, schema):
+    """Tell chat about the new URL of a tool it may be using, or with a None schema, that the tool was stopped."""
+    with registry_lock:
+        chat = processes.get('chat')
+    if chat is None or tool_name == 'chat':
+        return
+    try:
+        chat['post']({tool_name: schema}, '/tools/schemas')
+    except (requests.RequestException, ValueError):
+        app.logger.warning(f"Failed to publish the schema of '{tool_name}' to chat")
+
+
+def supervise():
+    """Watch started tools, restarting those that crash."""
+    while not stopping.wait(supervise_interval):
+        try:
+            supervise_once()
+        except Exception:
+            app.logger.exception("Supervisor failed")
+
+
+def supervise_once():
+    with registry_lock:
+        tools = dict(processes)
+    for tool_name, tool in tools.items():
+        if reap_if_exited(tool_name):
+            continue
+        for replica in list(tool['replicas']):
+            try:
+                healthy = probe_session.get(f"{replica['url']}/openapi.json", timeout=ready_max_delay * 4).ok
+            except requests.RequestException:
+                healthy = False
+            replica['health_failures'] = 0 if healthy else replica['health_failures'] + 1
+            if replica['health_failures'] >= max_health_failures:
+                replica['failure'] = f"failed {max_health_failures} health checks"
+                stop_process(replica['process'])
+        if not reap_if_exited(tool_name):
+            scale(tool_name)
+    if hot_swap_enabled:
+        swap_changed_tools()
+    save_state()
+    now = time.monotonic()
+    with registry_lock:
+        due = [tool_name for tool_name, crash in crashed.items() if crash['restart_at'] <= now]
+    for tool_name in due:
+        app.logger.info(f"Restarting '{tool_name}'")
+        schemas, errors = ensure_started([tool_name])
+        if errors:
+            mark_crashed(tool_name, None, errors[tool_name])
+    evict_idle()
+
+
+def reap_if_exited(tool_name):
+    """Poll the replicas of a started tool, which also reaps them, and drop those that exited.
+
+    The tool is marked as crashed once none of its replicas is left; the supervisor replaces the others.
+    """
+    with registry_lock:
+        tool = processes.get(tool_name)
+        if tool is None:
+            return False
+        exited = [replica for replica in tool['replicas'] if replica['process'].poll() is not None]
+        if not exited:
+            return False
+        tool['replicas'] = [replica for replica in tool['replicas'] if replica['process'].returncode is None]
+        if tool['replicas']:
+            tool_stats[tool_name]['crashes'] += len(exited)
+            openapi_objects[tool_name] = schema = replicated_schema(tool_name)
+    reason = exited[0].get('failure') or f"exited with code {exited[0]['process'].returncode}"
+    if not tool['replicas']:
+        mark_crashed(tool_name, tool, reason)
+        return True
+    app.logger.warning(f"A replica of '{tool_name}' {reason}, {len(tool['replicas'])} left")
+    publish_schema(tool_name, schema)
+    return False
+
+
+def mark_crashed(tool_name, tool, reason):
+    """Remove a dead tool from the registry and schedule its restart, backing off when it keeps crashing."""
+    with registry_lock:
+        if tool is not None:
+            if processes.get(tool_name) is not tool:
+                return  # Already replaced
+            del processes[tool_name]
+            openapi_objects.pop(tool_name, None)
+        attempt = crash_attempts.get(tool_name, -1) + 1
+        if tool is not None and time.time() - tool['started_at'] > restart_max_delay:
+            attempt = 0  # It ran long enough, so this is a new crash rather than a crash loop
+        crash_attempts[tool_name] = attempt
+        delay = min(restart_initial_delay * 2 ** attempt, restart_max_delay)
+        crashed[tool_name] = {'reason': reason, 'attempt': attempt, 'restart_at': time.monotonic() + delay}
+        tool_stats.setdefault(tool_name, new_tool_stats())['crashes'] += 1
+    app.logger.warning(f"'{tool_name}' {reason}, restarting in {delay:.0f}s")
+
+
+def get_tool_handle(tool_name):
+    handle = {}
+
     def post(data, resource='/'):
-        endpoint = f'{url}{resource}'
+        endpoint = f"{handle['replicas'][0]['url']}{resource}"
         app.logger.info(f"{tool_name} POST {endpoint} \n{data}")
         return session.post(endpoint, json=data).json()
 
     def get(resource='/'):
-        endpoint = f'{url}{resource}'
+        endpoint = f"{handle['replicas'][0]['url']}{resource}"
         app.logger.info(f"{tool_name} GET {endpoint}")
         return session.get(endpoint).json()
 
-    return {'get': get, 'post': post}
+    handle.update({'get': get, 'post': post})
+    return handle
 
 
 def find_free_port():
@@ -135,6 +972,58 @@ def self_schema(host):
                     }
                 }
             },
+            "/scale": {
+                "post": {
+                    "summary": "Set the number of processes of a tool, starting it if needed.",
+                    "description": "Requests to the tool are spread across the servers listed in its schema. chat always runs as a single process.",
+                    "operationId": "scale_tool",
+                    "requestBody": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "required": [
+                                    "name",
+                                    "replicas"
+                                ],
+                                "properties": {
+                                    "name": {
+                                        "type": "string",
+                                        "description": "The name of the tool to scale."
+                                    },
+                                    "replicas": {
+                                        "type": "integer",
+                                        "minimum": 1,
+                                        "maximum": max_replicas,
+                                        "description": f"The number of processes to run, from 1 to {max_replicas}."
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            },
+            "/restart": {
+                "post": {
+                    "summary": "Restart a tool on its latest code, e.g. after editing it, without interrupting its callers.",
+                    "operationId": "restart_tool",
+                    "requestBody": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "required": [
+                                    "name"
+                                ],
+                                "properties": {
+                                    "name": {
+                                        "type": "string",
+                                        "description": "The name of the tool to restart."
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            },
             "/list": {
                 "get": {
                     "operationId": "list_tools",
@@ -149,42 +1038,252 @@ def self_schema(host):
 
 @app.route('/start', methods=['POST'])
 def start_tool_route():
-    """Endpoint to start a tool via HTTP POST request, returning its OpenAPI schema."""
-    tool_name = request.json['name']
-    if tool_name not in processes.keys():
-        start_tool(tool_name)
-    return openapi_objects[tool_name]
+    """Endpoint to start a tool via HTTP POST request, returning its OpenAPI schema.
+
+    The batch form `{"names": [...]}` starts all the tools at once and returns a schema per tool.
+    """
+    tool_names = request.json.get('names')
+    batch = tool_names is not None
+    if not batch:
+        tool_names = [request.json['name']]
+    schemas, errors = ensure_started(tool_names)
+    if errors:
+        return jsonify({'error': 'Failed to start tools', 'errors': errors}), 500
+    if batch:
+        return jsonify(schemas)
+    return schemas[tool_names[0]]
 
 
 @app.route('/list', methods=['GET'])
 def list_tools_route():
     """List the currently running tools."""
-    tool_names = sorted(os.listdir('..'))
+    sources = catalog.tools()
+    now = time.time()
+    with registry_lock:
+        started = dict(openapi_objects)
+        running = dict(processes)
+        starting = set(in_flight)
+        failed = dict(crashed)
+        stopped = dict(evicted)
+        stats = dict(tool_stats)
     tools = {}
-    for tool_name in tool_names:
-        if '__pycache__' in tool_name:
-            continue
+    for tool_name in sorted(sources):
         status = "Stopped"
         info = None
-        if tool_name in openapi_objects.keys():
+        if tool_name in started:
             status = "Started"
-            info = openapi_objects[tool_name]['info']
+            info = started[tool_name]['info']
+        elif tool_name in starting:
+            status = "Starting"
+        elif tool_name in failed:
+            status = "Crashed"
+        elif tool_name in stopped:
+            status = "Evicted"
         tools[tool_name] = {
             "status": status,
-            "info": info
+            "info": info,
+            "description": sources[tool_name]['description'],
+            "source": {key: sources[tool_name][key] for key in ('mtime', 'sha256')},
         }
+        if tool_name in stats:
+            tools[tool_name]["stats"] = stats[tool_name]
+        if f'/tools/{tool_name}' in hosted_apps:
+            tools[tool_name]["hosting"] = "in-process"
+        if tool_name in running:
+            tools[tool_name]["replicas"] = len(running[tool_name]['replicas'])
+            tools[tool_name]["revision"] = running[tool_name]['revision']
+            tools[tool_name]["outdated"] = running[tool_name]['sha256'] != sources[tool_name]['sha256']
+            tools[tool_name]["uptime_seconds"] = round(now - running[tool_name]['started_at'], 1)
+            tools[tool_name]["idle_seconds"] = round(time.monotonic() - running[tool_name]['last_used'], 1)
+        if tool_name in failed:
+            tools[tool_name]["crash"] = {
+                "reason": failed[tool_name]['reason'],
+                "restart_in_seconds": round(max(failed[tool_name]['restart_at'] - time.monotonic(), 0), 1),
+            }
 
     return jsonify(tools)
 
 
+@app.route('/scale', methods=['POST'])
+def scale_tool_route():
+    """Set the number of replicas of a tool, returning its schema with a server per replica."""
+    tool_name = request.json['name']
+    replicas = request.json.get('replicas')
+    if not isinstance(replicas, int) or isinstance(replicas, bool):
+        return jsonify({'error': 'replicas must be an integer'}), 400
+    if not 1 <= replicas <= max_replicas:
+        return jsonify({'error': f'A tool needs from 1 to {max_replicas} replicas'}), 400
+    if tool_name in stateful_tools and replicas != 1:
+        # Its state would be split between processes, and callers can't tell which one holds theirs.
+        return jsonify({'error': f"'{tool_name}' keeps its state in memory, so it runs as a single process"}), 400
+    with registry_lock:
+        replica_counts[tool_name] = replicas
+    schemas, errors = ensure_started([tool_name])
+    if errors:
+        return jsonify({'error': 'Failed to start tools', 'errors': errors}), 500
+    errors = scale(tool_name)
+    with registry_lock:
+        schema = openapi_objects.get(tool_name)
+    if errors or schema is None:
+        return jsonify({'error': f"Failed to scale '{tool_name}'", 'errors': errors}), 500
+    return schema
+
+
+@app.route('/restart', methods=['POST'])
+def restart_tool_route():
+    """Start a new version of a running tool and switch to it without downtime, or start the tool if it isn't running."""
+    tool_name = request.json['name']
+    with registry_lock:
+        running = tool_name in processes or f'/tools/{tool_name}' in hosted_apps
+    if running:
+        errors = hot_swap(tool_name, "restart requested")
+    else:
+        _, errors = ensure_started([tool_name])
+    if errors:
+        return jsonify({'error': f"Failed to restart '{tool_name}'", 'errors': errors}), 500
+    with registry_lock:
+        return openapi_objects[tool_name]
+
+
+@app.route('/catalog/refresh', methods=['POST'])
+def refresh_catalog_route():
+    """Re-read the tools whose main.py changed without waiting for the next poll, e.g. after creating or editing one."""
+    changed = catalog.refresh()
+    return jsonify({'changed': sorted(changed), 'generation': catalog.generation})
+
+
+@app.route('/heartbeat', methods=['POST'])
+def heartbeat_route():
+    """Callers report the tools they use, so that they aren't evicted for being idle."""
+    tool_names = request.json.get('names') or [request.json['name']]
+    with registry_lock:
+        for tool_name in tool_names:
+            touch(tool_name)
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/tools/<tool_name>/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+@app.route('/tools/<tool_name>/<path:path>', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+def gateway_route(tool_name, path):
+    """Forward a request to the least busy replica of a tool, starting the tool if needed, and stream its response."""
+    if catalog.get(tool_name) is None:
+        return jsonify({'error': f'Tool {tool_name} does not exist'}), 404
+    if tool_name in hosted_tool_names:
+        # Not imported yet, or it would have been dispatched to its app: host it, then let the client retry.
+        schemas, errors = ensure_started([tool_name])
+        if errors:
+            return jsonify({'error': f"Failed to host '{tool_name}'", 'errors': errors}), 502
+        return redirect(request.url, code=307)
+    if not gateway_enabled:
+        return jsonify({'error': 'The gateway is disabled, set REGISTRY_GATEWAY=1'}), 404
+    schemas, errors = ensure_started([tool_name])
+    if errors:
+        return jsonify({'error': f"Failed to start '{tool_name}'", 'errors': errors}), 502
+    with registry_lock:
+        tool = processes.get(tool_name)
+        if tool is None or not tool['replicas']:
+            return jsonify({'error': f"'{tool_name}' is not running"}), 503
+        touch(tool_name)
+        replica = min(tool['replicas'], key=lambda candidate: candidate['in_flight'])
+        replica['in_flight'] += 1
+
+    def release():
+        with registry_lock:
+            replica['in_flight'] -= 1
+
+    url = f"{replica['url']}/{path}"
+    if request.query_string:
+        url = f"{url}?{request.query_string.decode('latin-1')}"
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in hop_by_hop_headers}
+    if request.content_length:
+        body = RequestBody(request.stream, request.content_length)
+    elif 'chunked' in request.headers.get('Transfer-Encoding', '').lower():
+        # Without a length, requests forwards the body in chunks as well.
+        body = iter(lambda: request.stream.read(64 * 1024), b'')
+    else:
+        body = None
+    try:
+        upstream = session.request(request.method, url, headers=headers, data=body, stream=True, allow_redirects=False)
+    except requests.RequestException as e:
+        release()
+        app.logger.warning(f"Gateway failed to reach '{tool_name}' at {url}: {e}")
+        return jsonify({'error': f"Failed to reach '{tool_name}'"}), 502
+    response = Response(
+        upstream.raw.stream(64 * 1024, decode_content=False),
+        status=upstream.status_code,
+        headers=[(name, value) for name, value in upstream.raw.headers.items()
+                 if name.lower() not in hop_by_hop_headers | server_headers],
+    )
+    # Called once the response is sent or the client went away, even if the body was never read
+    response.call_on_close(upstream.close)
+    response.call_on_close(release)
+    return response
+
+
+class RequestBody:
+    """File-like view of the incoming body; its length lets requests stream it with a Content-Length header."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(lambda: self.stream.read(64 * 1024), b'')
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+@app.route('/stats', methods=['GET'])
+def stats_route():
+    return jsonify({'http': http_client.stats()})
+
+
 @app.route('/shutdown', methods=['POST'])
+def shutdown_route():
+    """Endpoint to shut down the server and terminate all tools this server has started.
+
+    With `{"keep_tools": true}`, the tools keep running, and the next registry on this port reattaches to them.
+    """
+    global keep_tools
+    keep_tools = keep_tools or bool((request.get_json(silent=True) or {}).get('keep_tools'))
+    # exit() would only end this request's thread: signal the main thread once this response is sent.
+    threading.Timer(0.1, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    return jsonify({'status': 'Shutting down', 'keep_tools': keep_tools})
+
+
 def shutdown():
-    """Endpoint to shut down the server and terminate all tools this server has started."""
-    for tool_info in processes.values():
-        tool_process = tool_info.get('process')
-        if tool_process:
-            os.kill(tool_process.pid, signal.SIGTERM)
-            tool_process.wait()
+    """Terminate all tools this server has started, or save them to the state file with keep_tools, then exit."""
+    stopping.set()
+    # Replaced versions aren't in the state file, so they never outlive the registry.
+    with registry_lock:
+        replaced = list(draining)
+        draining.clear()
+    for tool_info in replaced:
+        for replica in tool_info['replicas']:
+            replica['process'].terminate()
+            replica['process'].wait()
+    if keep_tools:
+        save_state()
+        logging.info(f"Leaving {len(processes)} tools running, saved in {state_file}")
+    else:
+        with registry_lock:
+            tool_infos = list(processes.values())
+        for tool_info in tool_infos:
+            for replica in tool_info['replicas']:
+                replica['process'].terminate()
+                replica['process'].wait()
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        if transport == 'unix':
+            for socket_file in Path(runtime_dir).glob('*.sock'):
+                socket_file.unlink(missing_ok=True)
+    if zygote:
+        zygote.stdin.close()
+        zygote.wait()
     logging.info("Shutdown complete")
     exit(0)
 
@@ -193,4 +1292,14 @@ if __name__ == '__main__':
     signal.signal(signal.SIGTERM, lambda signum, frame: shutdown())
     signal.signal(signal.SIGINT, lambda signum, frame: shutdown())
     openapi_objects[self_name] = self_schema('localhost')
-    app.run(port=port)
+    os.makedirs(runtime_dir, mode=0o700, exist_ok=True)
+    reattach()
+    # The gateway looks tools up on every request, so the directory is polled on a thread of its own.
+    catalog.start_polling()
+    if zygote_enabled:
+        zygote = start_zygote()
+    if hosted_tool_names:
+        ensure_started(sorted(hosted_tool_names))
+    threading.Thread(target=supervise, name='supervisor', daemon=True).start()
+    # Each request runs on its own thread; a start in progress never holds registry_lock.
+    app.run(port=port, threaded=True)
@@ -0,0 +1,81 @@
+"""Warm parent process that forks tools with Flask, werkzeug, requests and http_client already imported.
+
+The registry writes one JSON command per line on stdin and reads one JSON reply per line on stdout:
+
+    {"cwd": "../search_tool", "argv": ["main.py", "5000"], "stdin": "{\"servers\": []}", "env": {}}
+    {"pid": 1234}
+
+Children are reaped automatically, so the registry tracks them by pid.
+"""
+import io
+import json
+import os
+import runpy
+import signal
+import sys
+import traceback
+
+# Preloaded so forked tools don't pay for these imports again.
+import flask  # noqa: F401
+import requests  # noqa: F401
+import werkzeug.serving  # noqa: F401
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import http_client  # noqa: F401
+
+
+def run_tool(command):
+    """Runs in the forked child: become `python main.py <port>` in the tool's directory."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.environ.update(command.get('env', {}))
+    os.chdir(command['cwd'])
+    script = os.path.abspath('main.py')
+    sys.path.insert(0, os.path.dirname(script))
+    sys.argv = [script] + command['argv'][1:]
+    sys.stdin = io.StringIO(command.get('stdin', ''))
+    try:
+        runpy.run_path(script, run_name='__main__')
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+
+
+def serve(commands, replies):
+    for line in commands:
+        command = json.loads(line)
+        try:
+            pid = os.fork()
+        except OSError as e:
+            replies.write(json.dumps({'error': str(e)}) + '\n')
+            replies.flush()
+            continue
+        if pid == 0:
+            commands.close()
+            replies.close()
+            exit_code = 1
+            try:
+                exit_code = run_tool(command)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+        replies.write(json.dumps({'pid': pid}) + '\n')
+        replies.flush()
+
+
+if __name__ == '__main__':
+    # Let the kernel reap exited tools; the registry watches them by pid.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Replies go over the original stdout; tools write their output to stderr, which is the registry's log.
+    replies = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    serve(sys.stdin, replies)
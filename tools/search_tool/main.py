@@ -1,14 +1,20 @@
 import sys
 import os
+import threading
+from collections import defaultdict
 from flask import Flask, request, jsonify
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from text_index import BM25Index, rank
+from tool_catalog import ToolCatalog
+
 port = int(sys.argv[1])
 servers = {}
 self_schema = {
     "openapi": "3.1.0",
     "info": {
         "title": "search_tool",
-        "description": "Search for tools by name.",
+        "description": "Search for tools by name, description, operations and code.",
         "version": "0.0.1",
         "port": port,
         "url": f"http://127.0.0.1:{port}"
@@ -16,7 +22,7 @@ self_schema = {
     "servers": [
         {
             "url": f"http://127.0.0.1:{port}",
-            "description": "Search for tools by name.",
+            "description": "Search for tools by name, description, operations and code.",
             "x-tool": "search_tool"
         }
     ],
@@ -31,7 +37,17 @@ self_schema = {
                             "properties": {
                                 "query": {
                                     "type": "string",
-                                    "description": "Query string to search for in tool names."
+                                    "description": "Words to search for in tool names, descriptions, operations and code; typos are tolerated."
+                                },
+                                "limit": {
+                                    "type": "integer",
+                                    "minimum": 0,
+                                    "description": "Maximum number of results, 20 by default."
+                                },
+                                "offset": {
+                                    "type": "integer",
+                                    "minimum": 0,
+                                    "description": "Number of results to skip, to get the next page."
                                 }
                             }
                         }
@@ -43,6 +59,20 @@ self_schema = {
 }
 app = Flask('search_tool')
 servers["search_tool"] = self_schema
+catalog = ToolCatalog()
+
+# Full-text index of the tools in the catalog, updated for the tools that changed since the last search
+index = BM25Index()
+indexed_sources = {}
+indexed_generation = None
+# trigram -> names containing it, to find the names containing a query without scanning all of them
+name_trigrams = defaultdict(set)
+index_lock = threading.Lock()
+# Names count more than the rest of a tool's text
+name_weight = 3
+# Added to the score of tools whose name contains the query as it was typed
+name_match_bonus = 1.0
+default_limit = 20
 
 
 @app.route('/openapi.json', methods=['GET'])
@@ -50,15 +80,92 @@ def identify():
     return jsonify(self_schema)
 
 
+def update_index():
+    """Index the tools added or changed since the last update, and drop the removed ones."""
+    global indexed_generation
+    sources = catalog.tools()
+    if catalog.generation == indexed_generation:
+        return sources
+    with index_lock:
+        for name in set(indexed_sources) - set(sources):
+            index.remove(name)
+            del indexed_sources[name]
+            for trigram in trigrams(name):
+                name_trigrams[trigram].discard(name)
+                if not name_trigrams[trigram]:
+                    del name_trigrams[trigram]
+        for name, source in sources.items():
+            if indexed_sources.get(name) != source['sha256']:
+                index.add(name, describe(source))
+                indexed_sources[name] = source['sha256']
+                for trigram in trigrams(name):
+                    name_trigrams[trigram].add(name)
+        indexed_generation = catalog.generation
+    return sources
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def names_containing(query, names):
+    """Names containing the query as it was typed; called with index_lock held."""
+    if len(query) < 3:
+        return [name for name in names if query in name]
+    candidates = sorted((name_trigrams.get(trigram, set()) for trigram in trigrams(query)), key=len)
+    return [name for name in candidates[0].intersection(*candidates[1:]) if query in name]
+
+
+def describe(source):
+    return ' '.join([source['name']] * name_weight + [
+        source['title'] or '',
+        source['description'] or '',
+        *source['summaries'],
+        *source['operation_ids'],
+        *source['paths'],
+        *source['functions'],
+    ])
+
+
 @app.route('/search', methods=['POST'])
 def search_tool():
     data = request.json
     query = data['query']
-    tools_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'tools'))
-    all_tools = [name for name in os.listdir(tools_dir) if os.path.isdir(os.path.join(tools_dir, name))]
-    matching_tools = [name for name in all_tools if query in name]
-    return jsonify({'query': query, 'matching_tools': matching_tools})
+    try:
+        limit = int(data.get('limit', default_limit))
+        offset = int(data.get('offset', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit < 0 or offset < 0:
+        return jsonify({'error': 'limit and offset must not be negative'}), 400
+    sources = update_index()
+    if query.strip():
+        with index_lock:
+            scores = index.match(query, fuzzy=True)
+            for name in names_containing(query, indexed_sources):
+                scores[name] = scores.get(name, 0.0) + name_match_bonus
+    else:
+        # An empty query lists every tool, by name
+        scores = dict.fromkeys(sources, 0.0)
+    page = rank(scores, limit, offset)
+    results = [{
+        'name': name,
+        'score': round(score, 4),
+        'title': sources[name]['title'],
+        'description': sources[name]['description'],
+    } for name, score in page if name in sources]
+    return jsonify({
+        'query': query,
+        'matching_tools': [result['name'] for result in results],
+        'results': results,
+        'total': len(scores),
+        'offset': offset,
+        'limit': limit,
+    })
+
 
+# Polls the tools directory on a thread of its own, so that searches never wait for it
+catalog.start_polling(on_change=update_index)
 
 if __name__ == '__main__':
-    app.run(port=port)
+    app.run(host=os.environ.get('TOOL_HOST', '127.0.0.1'), port=port)